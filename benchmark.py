@@ -0,0 +1,627 @@
+# Benchmark do gerente SNMP contra agentes simulados locais
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api, rfc1902, rfc1905
+
+
+# ******************************* Agente simulado *******************************
+class AgenteSimulado(asyncio.DatagramProtocol):
+    # Agente SNMP v1/v2c mínimo que responde GET, GETNEXT e GETBULK a partir de uma MIB em memória.
+    # Os contadores crescem com o tempo para que as taxas calculadas pelo gerente sejam realistas.
+    def __init__(self, interfaces=4, latencia=0.0, perda=0.0, community='public', tamanho_maximo=65507,
+                 esparso=False):
+        self.interfaces = interfaces
+        # Com esparso os ifIndex não são contíguos (1, 3, 5, ...), como em switches modulares
+        self.indices = [2 * i - 1 if esparso else i for i in range(1, interfaces + 1)]
+        self.tamanho_maximo = tamanho_maximo
+        self.latencia = latencia
+        self.perda = perda
+        self.community = community
+        self.inicio = time.time()
+        self.transport = None
+        self.requisicoes = 0
+        self.mib = self.montar_mib()
+        self.chaves = sorted(self.mib)
+
+    def contador(self, base, taxa, bits=32):
+        tipo = rfc1902.Counter64 if bits == 64 else rfc1902.Counter32
+        return lambda: tipo((base + int(taxa * (time.time() - self.inicio))) % (2 ** bits))
+
+    def montar_mib(self):
+        mib = {
+            (1, 3, 6, 1, 2, 1, 1, 1, 0): lambda: rfc1902.OctetString(
+                'Hardware: Intel64 Family 6 Model 158 - Software: Agente Simulado Version 1.0'),
+            (1, 3, 6, 1, 2, 1, 1, 2, 0): lambda: rfc1902.ObjectIdentifier((1, 3, 6, 1, 4, 1, 8072, 3, 2, 10)),
+            (1, 3, 6, 1, 2, 1, 1, 3, 0): lambda: rfc1902.TimeTicks(int((time.time() - self.inicio) * 100) + 360000),
+            (1, 3, 6, 1, 2, 1, 1, 4, 0): lambda: rfc1902.OctetString('admin@simulado'),
+            (1, 3, 6, 1, 2, 1, 1, 5, 0): lambda: rfc1902.OctetString('simulado'),
+            (1, 3, 6, 1, 2, 1, 1, 6, 0): lambda: rfc1902.OctetString('Laboratorio'),
+            (1, 3, 6, 1, 2, 1, 1, 7, 0): lambda: rfc1902.Integer(72),
+            (1, 3, 6, 1, 2, 1, 2, 1, 0): lambda: rfc1902.Integer(self.interfaces),
+            (1, 3, 6, 1, 2, 1, 4, 3, 0): self.contador(100000, 500),
+            (1, 3, 6, 1, 2, 1, 4, 4, 0): self.contador(10, 1),
+            (1, 3, 6, 1, 2, 1, 4, 5, 0): self.contador(5, 0.5),
+            (1, 3, 6, 1, 2, 1, 4, 6, 0): self.contador(2000, 50),
+            (1, 3, 6, 1, 2, 1, 4, 7, 0): self.contador(1, 0.1),
+            (1, 3, 6, 1, 2, 1, 5, 21, 0): self.contador(30, 2),
+            (1, 3, 6, 1, 2, 1, 31, 1, 5, 0): lambda: rfc1902.TimeTicks(100),
+        }
+
+        for i in self.indices:
+            tabela = (1, 3, 6, 1, 2, 1, 2, 2, 1)
+            tabela_x = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1)
+            mib[tabela + (1, i)] = lambda i=i: rfc1902.Integer(i)
+            mib[tabela + (2, i)] = lambda i=i: rfc1902.OctetString(f'Interface {i}')
+            mib[tabela + (5, i)] = lambda: rfc1902.Gauge32(1000000000)
+            mib[tabela + (10, i)] = self.contador(i * 1000, 125000)
+            mib[tabela + (11, i)] = self.contador(i * 100, 1000)
+            mib[tabela + (12, i)] = self.contador(i * 10, 10)
+            mib[tabela + (14, i)] = self.contador(i, 1)
+            mib[tabela + (16, i)] = self.contador(i * 2000, 62500)
+            mib[tabela_x + (1, i)] = lambda i=i: rfc1902.OctetString(f'eth{i - 1}')
+            mib[tabela_x + (6, i)] = self.contador(i * 1000, 125000, 64)
+            mib[tabela_x + (10, i)] = self.contador(i * 2000, 62500, 64)
+            mib[tabela_x + (15, i)] = lambda: rfc1902.Gauge32(1000)
+
+        return mib
+
+    def proximo(self, oid):
+        # Primeiro OID estritamente maior que oid na ordem lexicográfica
+        inicio, fim = 0, len(self.chaves)
+        while inicio < fim:
+            meio = (inicio + fim) // 2
+            if self.chaves[meio] <= oid:
+                inicio = meio + 1
+            else:
+                fim = meio
+        return self.chaves[inicio] if inicio < len(self.chaves) else None
+
+    def visivel(self, oid, versao):
+        # Contadores de 64 bits não existem no SNMPv1
+        return versao != api.protoVersion1 or not isinstance(self.mib[oid](), rfc1902.Counter64)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.perda and random.random() < self.perda:
+            return
+
+        try:
+            resposta = self.responder(data)
+        except Exception:
+            return
+
+        if resposta is None:
+            return
+
+        self.requisicoes += 1
+        if self.latencia:
+            asyncio.get_event_loop().call_later(self.latencia, self.transport.sendto, resposta, addr)
+        else:
+            self.transport.sendto(resposta, addr)
+
+    def responder(self, data):
+        versao = int(api.decodeMessageVersion(data))
+        p_mod = api.protoModules[versao]
+        msg, _ = decoder.decode(data, asn1Spec=p_mod.Message())
+
+        if str(p_mod.apiMessage.getCommunity(msg)) != self.community:
+            return None
+
+        req = p_mod.apiMessage.getPDU(msg)
+        rsp_msg = p_mod.apiMessage.getResponse(msg)
+        rsp = p_mod.apiMessage.getPDU(rsp_msg)
+        var_binds = []
+        erro = None
+
+        if req.isSameTypeWith(p_mod.GetRequestPDU()):
+            for indice, (oid, _) in enumerate(p_mod.apiPDU.getVarBinds(req)):
+                oid = tuple(oid)
+                if oid in self.mib and self.visivel(oid, versao):
+                    var_binds.append((oid, self.mib[oid]()))
+                elif versao == api.protoVersion1:
+                    erro = erro or (indice + 1)
+                    var_binds.append((oid, p_mod.Null('')))
+                else:
+                    var_binds.append((oid, rfc1905.noSuchObject))
+
+        elif req.isSameTypeWith(p_mod.GetNextRequestPDU()):
+            for indice, (oid, _) in enumerate(p_mod.apiPDU.getVarBinds(req)):
+                proximo = self.proximo(tuple(oid))
+                while proximo is not None and not self.visivel(proximo, versao):
+                    proximo = self.proximo(proximo)
+                if proximo is not None:
+                    var_binds.append((proximo, self.mib[proximo]()))
+                elif versao == api.protoVersion1:
+                    erro = erro or (indice + 1)
+                    var_binds.append((tuple(oid), p_mod.Null('')))
+                else:
+                    var_binds.append((tuple(oid), rfc1905.endOfMibView))
+
+        elif versao != api.protoVersion1 and req.isSameTypeWith(p_mod.GetBulkRequestPDU()):
+            non_repeaters = int(p_mod.apiBulkPDU.getNonRepeaters(req))
+            max_repetitions = int(p_mod.apiBulkPDU.getMaxRepetitions(req))
+            pedidos = [tuple(oid) for oid, _ in p_mod.apiBulkPDU.getVarBinds(req)]
+
+            for oid in pedidos[:non_repeaters]:
+                proximo = self.proximo(oid)
+                var_binds.append((proximo, self.mib[proximo]()) if proximo else (oid, rfc1905.endOfMibView))
+
+            repetidores = pedidos[non_repeaters:]
+            for _ in range(max_repetitions if repetidores else 0):
+                seguintes = []
+                for oid in repetidores:
+                    proximo = self.proximo(oid)
+                    if proximo is None:
+                        var_binds.append((oid, rfc1905.endOfMibView))
+                        seguintes.append(oid)
+                    else:
+                        var_binds.append((proximo, self.mib[proximo]()))
+                        seguintes.append(proximo)
+                repetidores = seguintes
+
+        else:
+            return None
+
+        if erro:
+            p_mod.apiPDU.setErrorStatus(rsp, 2)
+            p_mod.apiPDU.setErrorIndex(rsp, erro)
+        p_mod.apiPDU.setVarBinds(rsp, var_binds)
+        resposta = encoder.encode(rsp_msg)
+
+        # tooBig: a resposta não cabe no tamanho máximo de mensagem do agente
+        if len(resposta) > self.tamanho_maximo:
+            p_mod.apiPDU.setErrorStatus(rsp, 1)
+            p_mod.apiPDU.setErrorIndex(rsp, 0)
+            p_mod.apiPDU.setVarBinds(rsp, p_mod.apiPDU.getVarBinds(req))
+            resposta = encoder.encode(rsp_msg)
+
+        return resposta
+
+
+def iniciar_agentes(quantidade=1, interfaces=4, latencia=0.0, perda=0.0, porta_inicial=16100):
+    # Sobe os agentes simulados em um laço de eventos próprio e devolve as portas usadas
+    loop = asyncio.new_event_loop()
+    agentes = []
+
+    async def abrir():
+        for i in range(quantidade):
+            agente = AgenteSimulado(interfaces, latencia, perda)
+            await loop.create_datagram_endpoint(lambda a=agente: a, local_addr=('127.0.0.1', porta_inicial + i))
+            agentes.append(agente)
+
+    loop.run_until_complete(abrir())
+    threading.Thread(target=loop.run_forever, name='agentes-simulados', daemon=True).start()
+
+    return loop, agentes
+
+
+def servir_agentes(quantidade, interfaces, latencia, perda, porta_inicial, pronto):
+    iniciar_agentes(quantidade, interfaces, latencia, perda, porta_inicial)
+    pronto.set()
+    while True:
+        time.sleep(3600)
+
+
+def processo_agentes(quantidade, interfaces=4, latencia=0.0, perda=0.0, porta_inicial=16100):
+    # Os agentes rodam em outro processo para não disputar a CPU com o gerente medido
+    pronto = multiprocessing.Event()
+    processo = multiprocessing.Process(
+        target=servir_agentes,
+        args=(quantidade, interfaces, latencia, perda, porta_inicial, pronto),
+        daemon=True
+    )
+    processo.start()
+    pronto.wait()
+    return processo
+
+
+# ******************************* Medições *******************************
+def percentis(valores, pontos=(50, 90, 99)):
+    # Percentis com interpolação linear entre as duas amostras mais próximas, mais o máximo
+    ordenados = sorted(valores)
+    resultado = {}
+    for ponto in pontos:
+        posicao = (len(ordenados) - 1) * ponto / 100
+        inferior = int(posicao)
+        superior = min(inferior + 1, len(ordenados) - 1)
+        resultado[f'p{ponto}'] = (ordenados[inferior]
+                                  + (ordenados[superior] - ordenados[inferior]) * (posicao - inferior))
+    resultado['max'] = ordenados[-1]
+    return resultado
+
+
+def dispositivos_simulados(quantidade, porta_inicial=16100, versao='v2c'):
+    return {
+        f'agente{i}': {'ip': '127.0.0.1', 'port': porta_inicial + i, 'community': 'public', 'interval_time': 5,
+                       'version': versao}
+        for i in range(quantidade)
+    }
+
+
+def total_instrumentacao(main, nome):
+    # Soma de um histograma da instrumentação do gerente em todos os rótulos: (observações, soma)
+    histogramas = [histograma for (metrica, _), histograma in main.metricas.estado()['histogramas'].items()
+                   if metrica == nome]
+    return (sum(histograma['total'] for histograma in histogramas),
+            sum(histograma['soma'] for histograma in histogramas))
+
+
+def medir_coleta(coletor, rodadas):
+    # Rodadas completas de coleta: duração e CPU de cada tick, latência de cada dispositivo, vazão em dispositivos
+    # e varbinds por segundo e pico de memória alocada durante uma rodada extra
+    import main
+
+    duracoes = []
+
+    async def cronometrar(nome, device, semaforo):
+        inicio = time.perf_counter()
+        amostra = await coletor.coletar_dispositivo(nome, device, semaforo)
+        duracoes.append(time.perf_counter() - inicio)
+        return amostra
+
+    async def rodada():
+        semaforo = asyncio.Semaphore(coletor.concorrencia)
+        return await asyncio.gather(*[cronometrar(nome, device, semaforo)
+                                      for nome, device in list(coletor.dispositivos.items())])
+
+    async def rodar():
+        # A primeira rodada cria transportes, sessões e inventários e fica fora da medição
+        await rodada()
+        duracoes.clear()
+        requisicoes, varbinds = total_instrumentacao(main, 'requisicao_varbinds')
+
+        ticks, cpu, falhas = [], [], 0
+        for _ in range(rodadas):
+            inicio = time.perf_counter()
+            inicio_cpu = time.process_time()
+            amostras = await rodada()
+            ticks.append(time.perf_counter() - inicio)
+            cpu.append(time.process_time() - inicio_cpu)
+            falhas += sum(amostra is None for amostra in amostras)
+
+        requisicoes_final, varbinds_final = total_instrumentacao(main, 'requisicao_varbinds')
+        latencias = list(duracoes)
+
+        # Com o tracemalloc ligado a coleta fica bem mais lenta, então esta rodada não tem tempo limite
+        timeout = coletor.timeout
+        coletor.timeout = None
+        tracemalloc.start()
+        await rodada()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        coletor.timeout = timeout
+
+        total = sum(ticks)
+        return {
+            'dispositivos': len(coletor.dispositivos),
+            'rodadas': rodadas,
+            'tick': percentis(ticks),
+            'tick_cpu': percentis(cpu),
+            'latencia_dispositivo': percentis(latencias),
+            'dispositivos_s': len(coletor.dispositivos) * rodadas / total,
+            'requisicoes_s': (requisicoes_final - requisicoes) / total,
+            'varbinds_s': (varbinds_final - varbinds) / total,
+            'falhas': falhas,
+            'memoria_pico': pico
+        }
+
+    return asyncio.run(rodar())
+
+
+def medir_funcao(funcao, repeticoes):
+    # Tempo e CPU de chamadas repetidas; o pico de memória vem de uma chamada extra com o tracemalloc ligado,
+    # que deixaria as demais mais lentas
+    from dash.exceptions import PreventUpdate
+
+    tempos, cpu = [], []
+    for _ in range(repeticoes + 1):
+        inicio = time.perf_counter()
+        inicio_cpu = time.process_time()
+        try:
+            funcao()
+        except PreventUpdate:
+            pass
+        tempos.append(time.perf_counter() - inicio)
+        cpu.append(time.process_time() - inicio_cpu)
+
+    tracemalloc.start()
+    try:
+        funcao()
+    except PreventUpdate:
+        pass
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # A primeira chamada aquece caches e fica fora dos percentis
+    return {'tempo': percentis(tempos[1:]), 'cpu': percentis(cpu[1:]), 'memoria_pico': pico}
+
+
+def preencher_buffers(coletor, nome, pontos):
+    # Repete a última amostra para trás no tempo até os buffers terem `pontos` pontos, como depois de horas de coleta
+    amostra = coletor.ultima_amostra(nome)
+    intervalo = int(coletor.dispositivos[nome]['interval_time'])
+    for i in range(pontos, 0, -1):
+        coletor.registrar(nome, dict(amostra, timestamp=amostra['timestamp'] - i * intervalo))
+    coletor.registrar(nome, amostra)
+
+
+def medir_funcoes(coletor, repeticoes):
+    # Funções de consulta síncronas e callbacks do Dash, com o coletor já populado como a interface o encontraria
+    import main
+
+    nome, device = next(iter(coletor.dispositivos.items()))
+    main.devices.clear()
+    main.devices.update(coletor.dispositivos)
+    main.coletor = coletor
+    preencher_buffers(coletor, nome, main.capacidadeBuffer)
+
+    # Os gráficos são estendidos a partir do penúltimo ponto, então cada chamada envia um ponto novo
+    figuras = main.update_graphs(nome, 0)
+    ultimos = {metrica: timestamp - 1 for metrica, timestamp in figuras[-1].items()}
+
+    funcoes = {
+        'snmpgetmulti': lambda: main.snmpgetmulti(['sysUpTime'] + main.oids_escalares, device),
+        'snmptabela': lambda: main.snmptabela(main.oids_tabelas, device),
+        'update_graphs': lambda: main.update_graphs(nome, 0),
+        'extend_graphs': lambda: main.extend_graphs(1, ultimos, nome, 0),
+        'update_data': lambda: main.update_data(1, nome, None),
+        'update_status': lambda: main.update_status(1, nome),
+        'update_fleet': lambda: main.update_fleet(1, 0, main.linhasFrota, [{'column_id': 'taxa', 'direction': 'desc'}])
+    }
+    return {nome_funcao: medir_funcao(funcao, repeticoes) for nome_funcao, funcao in funcoes.items()}
+
+
+# ******************************* Escalabilidade do coletor *******************************
+def medir_tick(quantidade, porta_inicial=16100, rodadas=5, concorrencia=100, timeout=10):
+    # Tempo de uma rodada completa de coleta de `quantidade` dispositivos, um agente simulado por dispositivo
+    import main
+
+    dispositivos = dispositivos_simulados(quantidade, porta_inicial, versao='v1')
+    coletor = main.Coletor(dispositivos, concorrencia, timeout)
+    resultado = medir_coleta(coletor, rodadas)
+    return resultado['tick']['p50'], resultado['tick_cpu']['p50'], resultado['falhas']
+
+
+def cpu_processos(pids):
+    # Tempo de CPU (s) já consumido por outros processos, lido do /proc; None fora do Linux
+    try:
+        total = 0
+        for pid in pids:
+            with open(f'/proc/{pid}/stat') as arquivo:
+                campos = arquivo.read().rsplit(')', 1)[1].split()
+            total += int(campos[11]) + int(campos[12])
+        return total / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def medir_distribuido(quantidade, processos, porta_inicial=16100, intervalo=5, aquecimento=15, duracao=30,
+                      concorrencia=100, timeout=10, versao='v2c'):
+    # Coleta contínua com o ColetorDistribuido em `processos` processos, como em produção com processosColetor > 0.
+    # Cada dispositivo deveria receber uma amostra a cada `intervalo` s: o período efetivo entre amostras seguidas,
+    # as coletas perdidas (períodos acima de 1,5 intervalo) e a CPU de todos os processos por intervalo mostram se a
+    # coleta acompanha o número de dispositivos
+    import main
+
+    dispositivos = dispositivos_simulados(quantidade, porta_inicial, versao)
+    for device in dispositivos.values():
+        device['interval_time'] = intervalo
+    coletor = main.ColetorDistribuido(dispositivos, processos, concorrencia=concorrencia, timeout=timeout)
+
+    timestamps = {nome: [] for nome in dispositivos}
+    registrar = coletor.registrar
+
+    def registrar_medindo(nome, amostra):
+        timestamps[nome].append(amostra['timestamp'])
+        registrar(nome, amostra)
+
+    coletor.registrar = registrar_medindo
+    coletor.iniciar()
+    try:
+        # Sobe os processos, cria sessões e lê os inventários antes da medição
+        time.sleep(aquecimento)
+        pids = [processo.pid for processo, _ in list(coletor.trabalhadores.values())]
+        inicio, inicio_cpu = time.time(), cpu_processos(pids + [os.getpid()])
+        time.sleep(duracao)
+        fim, fim_cpu = time.time(), cpu_processos(pids + [os.getpid()])
+    finally:
+        coletor.finalizar()
+
+    periodos, perdidas, amostras = [], 0, 0
+    for nome, instantes in timestamps.items():
+        instantes = [instante for instante in instantes if inicio <= instante <= fim]
+        amostras += len(instantes)
+        if not instantes:
+            perdidas += int(duracao // intervalo)
+            continue
+        # Os trechos sem amostra no começo e no fim da janela também contam
+        lacunas = [b - a for a, b in zip([inicio] + instantes, instantes + [fim])]
+        periodos += lacunas[1:-1]
+        perdidas += sum(max(0, round(lacuna / intervalo) - 1) for lacuna in lacunas if lacuna > 1.5 * intervalo)
+
+    return {
+        'dispositivos': quantidade,
+        'processos': processos,
+        'intervalo': intervalo,
+        'periodo': percentis(periodos) if periodos else None,
+        'amostras_s': amostras / (fim - inicio),
+        'cpu_intervalo': None if inicio_cpu is None or fim_cpu is None
+        else (fim_cpu - inicio_cpu) * intervalo / (fim - inicio),
+        'perdidas': perdidas
+    }
+
+
+def escalabilidade(quantidades, interfaces, latencia, porta_inicial=16100, concorrencia=100, timeout=10,
+                   processos=0):
+    processo = processo_agentes(max(quantidades), interfaces, latencia, 0.0, porta_inicial)
+
+    try:
+        # O tempo de CPU do gerente mostra quanto do tick é codificação BER e não espera pela rede
+        print(f'{"dispositivos":>12} {"tick (s)":>10} {"cpu (s)":>10} {"falhas":>7}')
+        for quantidade in quantidades:
+            tick, cpu, falhas = medir_tick(quantidade, porta_inicial, concorrencia=concorrencia, timeout=timeout)
+            print(f'{quantidade:>12} {tick:>10.3f} {cpu:>10.3f} {falhas:>7}')
+
+        # Com a coleta dividida em processos o período de cada dispositivo deve ficar no intervalo configurado
+        # enquanto houver CPU: cpu/intervalo é a soma de todos os processos e precisa caber nos núcleos disponíveis
+        if processos:
+            print(f'\n{processos} processo(s) de coleta, intervalo de 5 s ({os.cpu_count()} CPU(s))')
+            print(f'{"dispositivos":>12} {"período p50":>12} {"período p99":>12} {"cpu/intervalo":>14} '
+                  f'{"perdidas":>9}')
+            for quantidade in quantidades:
+                resultado = medir_distribuido(quantidade, processos, porta_inicial, concorrencia=concorrencia,
+                                              timeout=timeout, versao='v1')
+                periodo = resultado['periodo'] or {'p50': float('nan'), 'p99': float('nan')}
+                cpu = resultado['cpu_intervalo']
+                print(f'{quantidade:>12} {periodo["p50"]:>12.3f} {periodo["p99"]:>12.3f} '
+                      f'{float("nan") if cpu is None else cpu:>14.3f} {resultado["perdidas"]:>9}')
+    finally:
+        processo.terminate()
+
+
+# ******************************* Suíte de regressão *******************************
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def suite(quantidades, interfaces, latencia, perda, porta_inicial=16100, rodadas=10, repeticoes=50,
+          concorrencia=100, timeout=10, versao='v2c', processos=0):
+    # Coleta com cada quantidade de dispositivos e depois as funções de consulta e callbacks sobre o maior conjunto.
+    # Devolve um dicionário serializável em JSON
+    import main
+
+    resultado = {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit_atual(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'parametros': {'dispositivos': quantidades, 'interfaces': interfaces, 'latencia': latencia, 'perda': perda,
+                       'rodadas': rodadas, 'repeticoes': repeticoes, 'concorrencia': concorrencia,
+                       'timeout': timeout, 'versao': versao, 'processos': processos},
+        'coleta': [],
+        'coleta_distribuida': []
+    }
+
+    processo = processo_agentes(max(quantidades), interfaces, latencia, perda, porta_inicial)
+    try:
+        for quantidade in quantidades:
+            coletor = main.Coletor(dispositivos_simulados(quantidade, porta_inicial, versao), concorrencia, timeout)
+            resultado['coleta'].append(medir_coleta(coletor, rodadas))
+            print(f'{quantidade} dispositivo(s): tick p50 {resultado["coleta"][-1]["tick"]["p50"]:.3f} s')
+        resultado['funcoes'] = medir_funcoes(coletor, repeticoes)
+
+        for quantidade in quantidades if processos else []:
+            resultado['coleta_distribuida'].append(medir_distribuido(quantidade, processos, porta_inicial,
+                                                                     concorrencia=concorrencia, timeout=timeout,
+                                                                     versao=versao))
+            periodo = resultado['coleta_distribuida'][-1]['periodo']
+            print(f'{quantidade} dispositivo(s) em {processos} processo(s): período p99 '
+                  f'{periodo["p99"] if periodo else float("nan"):.3f} s')
+    finally:
+        processo.terminate()
+
+    if resource is not None:
+        # ru_maxrss vem em KiB no Linux
+        resultado['rss_maximo'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return resultado
+
+
+def comparar(atual, referencia, tolerancia, minimo=0.001):
+    # Medidas de tempo que pioraram mais que `tolerancia` (fração) em relação a um resultado anterior. Diferenças
+    # abaixo de `minimo` segundos são ruído de medição e não contam
+    regressoes = []
+
+    def verificar(nome, valor, anterior):
+        if anterior and valor > anterior * (1 + tolerancia) and valor - anterior > minimo:
+            regressoes.append(f'{nome}: {anterior:.4f} -> {valor:.4f} (+{(valor / anterior - 1) * 100:.0f}%)')
+
+    anteriores = {coleta['dispositivos']: coleta for coleta in referencia.get('coleta', [])}
+    for coleta in atual['coleta']:
+        anterior = anteriores.get(coleta['dispositivos'])
+        if anterior is not None:
+            for percentil in ('p50', 'p99'):
+                verificar(f'tick {percentil} ({coleta["dispositivos"]} dispositivos)', coleta['tick'][percentil],
+                          anterior['tick'][percentil])
+
+    anteriores = {coleta['dispositivos']: coleta for coleta in referencia.get('coleta_distribuida', [])}
+    for coleta in atual.get('coleta_distribuida', []):
+        anterior = anteriores.get(coleta['dispositivos'])
+        if anterior is not None and anterior['periodo'] and coleta['periodo']:
+            verificar(f'período p99 ({coleta["dispositivos"]} dispositivos, {coleta["processos"]} processos)',
+                      coleta['periodo']['p99'], anterior['periodo']['p99'])
+
+    for nome, medida in atual.get('funcoes', {}).items():
+        anterior = referencia.get('funcoes', {}).get(nome)
+        if anterior is not None:
+            verificar(f'{nome} p50', medida['tempo']['p50'], anterior['tempo']['p50'])
+
+    return regressoes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark do coletor SNMP com agentes simulados')
+    parser.add_argument('comando', choices=['agentes', 'escalabilidade', 'suite'])
+    parser.add_argument('--agentes', type=int, default=1)
+    parser.add_argument('--dispositivos', type=int, nargs='+', default=[1, 10, 50, 100, 250, 500])
+    parser.add_argument('--interfaces', type=int, default=4)
+    parser.add_argument('--latencia', type=float, default=0.05)
+    parser.add_argument('--perda', type=float, default=0.0)
+    parser.add_argument('--porta', type=int, default=16100)
+    parser.add_argument('--concorrencia', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--rodadas', type=int, default=10)
+    parser.add_argument('--repeticoes', type=int, default=50)
+    parser.add_argument('--versao', choices=['v1', 'v2c'], default='v2c')
+    parser.add_argument('--processos', type=int, default=0,
+                        help='também mede a coleta dividida em N processos (ColetorDistribuido)')
+    parser.add_argument('--saida', default='benchmark.json')
+    parser.add_argument('--referencia', help='resultado anterior para detectar regressões')
+    parser.add_argument('--tolerancia', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.comando == 'agentes':
+        iniciar_agentes(args.agentes, args.interfaces, args.latencia, args.perda, args.porta)
+        print(f'{args.agentes} agente(s) simulado(s) a partir da porta {args.porta}')
+        while True:
+            time.sleep(3600)
+    elif args.comando == 'escalabilidade':
+        escalabilidade(args.dispositivos, args.interfaces, args.latencia, args.porta, args.concorrencia,
+                       args.timeout, args.processos)
+    else:
+        resultado = suite(args.dispositivos, args.interfaces, args.latencia, args.perda, args.porta, args.rodadas,
+                          args.repeticoes, args.concorrencia, args.timeout, args.versao, args.processos)
+        with open(args.saida, 'w') as arquivo:
+            json.dump(resultado, arquivo, indent=2)
+        print(f'Resultado gravado em {args.saida}')
+
+        if args.referencia:
+            with open(args.referencia) as arquivo:
+                regressoes = comparar(resultado, json.load(arquivo), args.tolerancia)
+            for regressao in regressoes:
+                print(f'Regressão: {regressao}')
+            if regressoes:
+                raise SystemExit(1)
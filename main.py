@@ -6,13 +6,63 @@
 # - Pedro Menuzzi Mascaró
 
 import dash
-from dash import dcc, html, Input, Output, State
+from dash import dcc, html, dash_table, Input, Output, State
 import plotly
 import plotly.graph_objs as go
-from collections import deque
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import islice
+import argparse
+import asyncio
+import atexit
+import bisect
+import csv
+import hashlib
+import heapq
+import importlib
+import ipaddress
+import json
+import multiprocessing
+import os
+import queue
+import random
+import signal
+import socket
+import sqlite3
+import threading
 import time
 from datetime import datetime
-from pysnmp.hlapi import *
+from dash.exceptions import PreventUpdate
+from flask import Response, g, request
+
+
+class ModuloPreguicoso:
+    # Importa o módulo apenas no primeiro acesso a um atributo. O pysnmp só é carregado quando há coleta,
+    # então a interface em modo de visualização sobe sem ele
+    def __init__(self, nome):
+        self.nome = nome
+        self.modulo = None
+
+    def __getattr__(self, atributo):
+        if self.modulo is None:
+            self.modulo = importlib.import_module(self.nome)
+        return getattr(self.modulo, atributo)
+
+
+hlapi = ModuloPreguicoso('pysnmp.hlapi')
+snmp_asyncio = ModuloPreguicoso('pysnmp.hlapi.asyncio')
+snmp_config = ModuloPreguicoso('pysnmp.entity.config')
+snmp_udp = ModuloPreguicoso('pysnmp.carrier.asyncio.dgram.udp')
+snmp_ntfrcv = ModuloPreguicoso('pysnmp.entity.rfc3413.ntfrcv')
+snmp_carrier_erro = ModuloPreguicoso('pysnmp.carrier.error')
+asn1_univ = ModuloPreguicoso('pyasn1.type.univ')
+
+# NumPy é opcional: quando presente, as taxas de todas as interfaces são calculadas de forma vetorizada
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # SNMP parameters
 devices = {
@@ -23,12 +73,87 @@ devices = {
     }
 }
 
-selectedDevice = devices['localhost']
-host = selectedDevice['ip']
-community = selectedDevice['community']
-intervalTime = selectedDevice['interval_time']
+# Dispositivo usado quando uma função de consulta não recebe `device` e exibido ao abrir a interface; a seleção
+# de cada aba fica no navegador (dcc.Store), nunca no servidor
+dispositivoPadrao = 'localhost'
+intervalTime = devices[dispositivoPadrao]['interval_time']
 port = 161
 
+# Versões SNMP suportadas e o mpModel correspondente do pysnmp. No v3 o dispositivo define 'user' e, conforme o
+# nível de segurança, 'auth_protocol'/'auth_key' e 'priv_protocol'/'priv_key' em vez de 'community'
+snmpVersions = {
+    'v1': 0,
+    'v2c': 1,
+    'v3': 3
+}
+
+# Protocolos de autenticação e de privacidade do USM aceitos no cadastro, com o nome correspondente no pysnmp
+protocolosAutenticacao = {
+    'none': 'usmNoAuthProtocol',
+    'md5': 'usmHMACMD5AuthProtocol',
+    'sha': 'usmHMACSHAAuthProtocol',
+    'sha224': 'usmHMAC128SHA224AuthProtocol',
+    'sha256': 'usmHMAC192SHA256AuthProtocol',
+    'sha384': 'usmHMAC256SHA384AuthProtocol',
+    'sha512': 'usmHMAC384SHA512AuthProtocol'
+}
+protocolosPrivacidade = {
+    'none': 'usmNoPrivProtocol',
+    'des': 'usmDESPrivProtocol',
+    '3des': 'usm3DESEDEPrivProtocol',
+    'aes': 'usmAesCfb128Protocol',
+    'aes192': 'usmAesCfb192Protocol',
+    'aes256': 'usmAesCfb256Protocol'
+}
+
+# Timeout (s) e retransmissões de cada requisição quando o dispositivo não define 'timeout' e 'retries'. A codificação
+# BER disputa a CPU com as respostas que chegam, então com muitos dispositivos por processo uma resposta pode esperar
+# mais de 1 s no laço de eventos; 3 s evita timeouts falsos mesmo com centenas de dispositivos
+snmpTimeout = 3
+snmpRetries = 1
+
+# Falhas seguidas até o agente ser considerado inativo; a partir daí cada coleta vira uma única sondagem do
+# sysUpTime, sem retransmissões, até o agente voltar a responder
+limiteFalhas = 3
+
+# Tamanho máximo de mensagem SNMP assumido quando o dispositivo não define 'max_msg_size'
+maxMsgSize = 1472
+
+# Limite do max-repetitions ajustado automaticamente nas leituras de tabela com GETBULK
+maxRepetitions = 64
+
+# Banco SQLite com o histórico das métricas coletadas
+seriesDatabase = 'series.db'
+
+# Tempo máximo (s) que o inventário de um dispositivo fica em cache sem ser relido
+ttlInventario = 3600
+
+# Pontos mantidos em memória por métrica de cada dispositivo e quantos deles aparecem nos gráficos em tempo real
+capacidadeBuffer = 2880
+pontosGrafico = 120
+
+# Variação aleatória (fração do intervalo) aplicada a cada agendamento, para espalhar as coletas no tempo,
+# e intervalo máximo (s) entre tentativas a um agente que não responde
+jitterColeta = 0.1
+backoffMaximo = 300
+
+# Segundos em que um dispositivo continua com prioridade na coleta depois de aparecer na interface
+tempoVisualizado = 30
+
+# Porta UDP em que o gerente recebe traps e informs
+trapPort = 162
+
+# Processos de coleta; com 0 o coletor roda em uma thread do próprio servidor web
+processosColetor = 0
+
+# Arquivo (JSON por linha) e URL de webhook que recebem os alertas; None desativa o destino
+arquivoAlertas = 'alertas.log'
+webhookAlertas = None
+
+# Interfaces destacadas por dispositivo e linhas por página na visão da frota
+interfacesFrota = 3
+linhasFrota = 25
+
 # Objetos utilizados no gerente
 oids = {
     'sysInformations': '1.3.6.1.2.1.1',
@@ -40,13 +165,18 @@ oids = {
     'sysLocation': '1.3.6.1.2.1.1.6.0',
     'sysServices': '1.3.6.1.2.1.1.7.0',
     'ifNumber': '1.3.6.1.2.1.2.1.0',
+    'ifTableLastChange': '1.3.6.1.2.1.31.1.5.0',
     'ifInErrors': '1.3.6.1.2.1.2.2.1.14',
     'ifSpeed': '1.3.6.1.2.1.2.2.1.5',
     'ifInUcastPkts': '1.3.6.1.2.1.2.2.1.11',
     'ifInNUcastPkts': '1.3.6.1.2.1.2.2.1.12',
     'ifInOctets': '1.3.6.1.2.1.2.2.1.10',
     'ifOutOctets': '1.3.6.1.2.1.2.2.1.16',
+    'ifDescr': '1.3.6.1.2.1.2.2.1.2',
     'ifName': '1.3.6.1.2.1.31.1.1.1.1',
+    'ifHCInOctets': '1.3.6.1.2.1.31.1.1.1.6',
+    'ifHCOutOctets': '1.3.6.1.2.1.31.1.1.1.10',
+    'ifHighSpeed': '1.3.6.1.2.1.31.1.1.1.15',
     'ipInHdrErrors': '1.3.6.1.2.1.4.4.0',
     'ipInAddrErrors': '1.3.6.1.2.1.4.5.0',
     'ipInUnknownProtos': '1.3.6.1.2.1.4.7.0',
@@ -55,104 +185,2427 @@ oids = {
     'icmpInEchoReps': '1.3.6.1.2.1.5.21.0',
 }
 
-# Configurações de Gráficos
-X = []
-Y = {key: [] for key in oids}
 
-agentStatus = {
-    'index': -1,
-    'background': 'transparent',
-    'color': 'transparent'
-}
+# ******************************* Instrumentação *******************************
+# Limites (s) dos histogramas de latência
+limitesLatencia = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Limites dos histogramas de tamanho das respostas, em número de varbinds
+limitesVarbinds = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+
+class Histograma:
+    # Contagens por faixa, soma e total de observações, no formato dos histogramas do Prometheus
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.contagens[bisect.bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+    def copia(self):
+        return {'limites': self.limites, 'contagens': list(self.contagens), 'soma': self.soma, 'total': self.total}
+
+
+class RegistroMetricas:
+    # Contadores e histogramas do próprio gerente, indexados por nome e rótulos e exportados no formato texto
+    # do Prometheus
+    def __init__(self, prefixo='snmp_gerente_'):
+        self.prefixo = prefixo
+        self.descricoes = {}
+        self.contadores = {}
+        self.histogramas = {}
+        self.lock = threading.Lock()
+
+    def descrever(self, nome, descricao):
+        self.descricoes[nome] = descricao
+
+    def contar(self, nome, valor=1, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self.lock:
+            self.contadores[chave] = self.contadores.get(chave, 0) + valor
+
+    def observar(self, nome, valor, limites=limitesLatencia, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self.lock:
+            histograma = self.histogramas.get(chave)
+            if histograma is None:
+                histograma = self.histogramas[chave] = Histograma(limites)
+            histograma.observar(valor)
+
+    def estado(self):
+        # Cópia serializável, usada para juntar as métricas dos processos de coleta
+        with self.lock:
+            return {'contadores': dict(self.contadores),
+                    'histogramas': {chave: histograma.copia() for chave, histograma in self.histogramas.items()}}
+
+    @staticmethod
+    def rotulos(pares, extras=()):
+        pares = list(pares) + list(extras)
+        if not pares:
+            return ''
+        valores = (str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, valor in pares)
+        return '{' + ','.join('%s="%s"' % (nome, valor) for (nome, _), valor in zip(pares, valores)) + '}'
+
+    def texto(self, outros=None):
+        # Junta o estado local com o de outros processos ({processo: estado}), diferenciados pelo rótulo 'processo'
+        fontes = [((), self.estado())]
+        fontes += [((('processo', processo),), estado) for processo, estado in sorted((outros or {}).items())]
+
+        series = {}
+        for extras, estado in fontes:
+            for (nome, pares), valor in estado['contadores'].items():
+                series.setdefault((nome, 'counter'), []).append((pares, extras, valor))
+            for (nome, pares), histograma in estado['histogramas'].items():
+                series.setdefault((nome, 'histogram'), []).append((pares, extras, histograma))
+
+        linhas = []
+        for (nome, tipo), amostras in sorted(series.items()):
+            completo = self.prefixo + nome
+            if nome in self.descricoes:
+                linhas.append('# HELP %s %s' % (completo, self.descricoes[nome]))
+            linhas.append('# TYPE %s %s' % (completo, tipo))
+
+            for pares, extras, valor in amostras:
+                if tipo == 'counter':
+                    linhas.append('%s%s %s' % (completo, self.rotulos(pares, extras), valor))
+                    continue
+
+                acumulado = 0
+                for limite, contagem in zip(list(valor['limites']) + ['+Inf'], valor['contagens']):
+                    acumulado += contagem
+                    linhas.append('%s_bucket%s %d' % (completo, self.rotulos(pares, extras + (('le', limite),)),
+                                                      acumulado))
+                linhas.append('%s_sum%s %s' % (completo, self.rotulos(pares, extras), valor['soma']))
+                linhas.append('%s_count%s %d' % (completo, self.rotulos(pares, extras), valor['total']))
+
+        return '\n'.join(linhas) + '\n'
+
+
+metricas = RegistroMetricas()
+metricas.descrever('requisicao_segundos', 'Latência de cada requisição SNMP por agente e operação')
+metricas.descrever('requisicao_varbinds', 'Varbinds em cada resposta SNMP')
+metricas.descrever('requisicao_timeouts_total', 'Requisições SNMP sem resposta')
+metricas.descrever('requisicao_erros_total', 'Requisições SNMP com erro')
+metricas.descrever('coleta_etapa_segundos', 'Duração de cada etapa da coleta por agente e grupo de OIDs')
+metricas.descrever('coleta_atraso_segundos', 'Atraso entre o horário planejado e o início de cada coleta')
+metricas.descrever('coleta_estouros_total', 'Coletas que terminaram depois do horário da próxima')
+metricas.descrever('coleta_falhas_total', 'Coletas sem resposta do dispositivo')
+metricas.descrever('callback_segundos', 'Tempo de execução dos callbacks da interface')
+metricas.descrever('alertas_total', 'Alertas disparados e resolvidos por regra')
+
+
+def rotulo_agente(device):
+    return '%s:%s' % (device['ip'], device.get('port', port))
+
+
+def medir_requisicao(device, operacao, inicio, error_indication, error_status, var_binds):
+    # Registra latência, tamanho da resposta e falhas de uma requisição SNMP. Timeouts e erros aparecem apenas aqui
+    # (/metrics), sem mensagem no console, que com muitos dispositivos seria inundado
+    agente = rotulo_agente(device)
+    metricas.observar('requisicao_segundos', time.time() - inicio, agente=agente, operacao=operacao)
 
+    if error_indication:
+        if type(error_indication).__name__ == 'RequestTimedOut':
+            metricas.contar('requisicao_timeouts_total', agente=agente, operacao=operacao)
+        else:
+            metricas.contar('requisicao_erros_total', agente=agente, operacao=operacao,
+                            erro=type(error_indication).__name__)
+    elif error_status:
+        metricas.contar('requisicao_erros_total', agente=agente, operacao=operacao,
+                        erro=error_status.prettyPrint())
+    else:
+        metricas.observar('requisicao_varbinds', len(var_binds), limitesVarbinds, operacao=operacao)
+
+
+@contextmanager
+def medir_etapa(device, grupo):
+    # Duração de uma etapa da coleta (um grupo de OIDs), com ou sem sucesso
+    inicio = time.time()
+    try:
+        yield
+    finally:
+        metricas.observar('coleta_etapa_segundos', time.time() - inicio, agente=rotulo_agente(device),
+                          grupo=grupo)
+
+
+# ******************************* Sessões SNMP *******************************
+class CacheUsm:
+    # Material do USM (SNMPv3) compartilhado por todas as SnmpEngine do processo. A chave mestra de cada senha
+    # (hash de 1 MB) é calculada uma vez por credencial; o engine ID autoritativo de cada agente é capturado da
+    # primeira resposta, e com ele as chaves localizadas, calculadas uma vez por (engine ID, credencial). Uma engine
+    # nova (sessão síncrona recriada, novo laço asyncio, outro processo de coleta) já recebe as chaves localizadas
+    # e o engine ID, sem refazer hash nem localização; boots/tempo do agente continuam no timeline do próprio pysnmp
+    def __init__(self):
+        self.mestras = {}
+        self.engine_ids = {}
+        self.localizadas = {}
+        self.lock = threading.Lock()
+
+    def observar(self, engine):
+        engine.observer.registerObserver(self.ao_responder, 'rfc3412.prepareDataElements:response')
+
+    def ao_responder(self, engine, ponto, contexto, *_):
+        if contexto.get('securityModel') == 3 and contexto.get('securityEngineId'):
+            endereco = (str(contexto['transportAddress'][0]), int(contexto['transportAddress'][1]))
+            with self.lock:
+                self.engine_ids[endereco] = bytes(contexto['securityEngineId'])
+
+    def usuario(self, credencial, endereco):
+        nome, autenticacao, chave_autenticacao, privacidade, chave_privacidade = credencial
+        protocolo_autenticacao = getattr(hlapi, protocolosAutenticacao[autenticacao])
+        protocolo_privacidade = getattr(hlapi, protocolosPrivacidade[privacidade])
+        servico_autenticacao = snmp_config.authServices[tuple(protocolo_autenticacao)]
+        servico_privacidade = snmp_config.privServices[tuple(protocolo_privacidade)]
+
+        with self.lock:
+            mestras = self.mestras.get(credencial)
+            if mestras is None:
+                mestras = self.mestras[credencial] = (
+                    chave_autenticacao and servico_autenticacao.hashPassphrase(chave_autenticacao),
+                    chave_privacidade and servico_privacidade.hashPassphrase(protocolo_autenticacao,
+                                                                            chave_privacidade)
+                )
+
+            engine_id = self.engine_ids.get(endereco)
+            if engine_id is None:
+                return hlapi.UsmUserData(nome, mestras[0], mestras[1], authProtocol=protocolo_autenticacao,
+                                         privProtocol=protocolo_privacidade, authKeyType=hlapi.usmKeyTypeMaster,
+                                         privKeyType=hlapi.usmKeyTypeMaster)
+
+            engine_id = hlapi.OctetString(engine_id)
+            localizadas = self.localizadas.get((engine_id, credencial))
+            if localizadas is None:
+                localizadas = self.localizadas[(engine_id, credencial)] = (
+                    mestras[0] and servico_autenticacao.localizeKey(mestras[0], engine_id),
+                    mestras[1] and servico_privacidade.localizeKey(protocolo_autenticacao, mestras[1], engine_id)
+                )
+
+        return hlapi.UsmUserData(nome, localizadas[0], localizadas[1], authProtocol=protocolo_autenticacao,
+                                 privProtocol=protocolo_privacidade, securityEngineId=engine_id,
+                                 authKeyType=hlapi.usmKeyTypeLocalized, privKeyType=hlapi.usmKeyTypeLocalized)
+
+
+cache_usm = CacheUsm()
+
+
+def credencial(device):
+    # Parte da chave da sessão que identifica as credenciais: a comunidade no v1/v2c, o usuário e as chaves no v3
+    if device.get('version', 'v1') != 'v3':
+        return device['community']
+    return (device['user'], device.get('auth_protocol') or ('sha' if device.get('auth_key') else 'none'),
+            device.get('auth_key'), device.get('priv_protocol') or ('aes' if device.get('priv_key') else 'none'),
+            device.get('priv_key'))
+
+
+def dados_autenticacao(credencial_param, version, endereco):
+    if version == 'v3':
+        return cache_usm.usuario(credencial_param, endereco)
+    return hlapi.CommunityData(credencial_param, mpModel=snmpVersions[version])
+
+
+def sobrecarga_mensagem(device):
+    # Bytes da mensagem além dos varbinds: cabeçalho e comunidade no v1/v2c; no v3 também o cabeçalho global e os
+    # parâmetros do USM (engine ID, usuário, autenticação e privacidade)
+    if device.get('version', 'v1') == 'v3':
+        return 64 + 128 + len(device['user'])
+    return 64 + len(device['community'])
+
+
+class Sessao:
+    # Engine, credenciais e transporte de um dispositivo, criados uma única vez e reutilizados
+    def __init__(self, host, port_param, credencial_param, version, timeout, retries):
+        self.engine = hlapi.SnmpEngine()
+        cache_usm.observar(self.engine)
+        self.transport = hlapi.UdpTransportTarget((host, port_param), timeout=timeout, retries=retries)
+        self.auth = dados_autenticacao(credencial_param, version, self.transport.transportAddr)
+        self.lock = threading.Lock()
+
+    def fechar(self):
+        if self.engine.transportDispatcher is not None:
+            self.engine.transportDispatcher.closeDispatcher()
+
+
+class PoolSessoes:
+    # Sessões indexadas por (host, porta, credencial, versão, timeout, retransmissões), com tamanho limitado.
+    # Atende as leituras síncronas (snmpgetmulti, snmptabela); o coletor usa o PoolSessoesAsync.
+    # Cada sessão é usada por uma requisição de cada vez, pois a SnmpEngine não é thread-safe.
+    def __init__(self, tamanho_maximo=64):
+        self.tamanho_maximo = tamanho_maximo
+        self.sessoes = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def chave(device):
+        return (device['ip'], device.get('port', port), credencial(device), device.get('version', 'v1'),
+                device.get('timeout', snmpTimeout), device.get('retries', snmpRetries))
+
+    def remover(self, chave):
+        sessao = self.sessoes.pop(chave)
+        sessao.fechar()
+
+    @contextmanager
+    def sessao(self, device):
+        chave = self.chave(device)
+
+        with self.lock:
+            sessao = self.sessoes.get(chave)
+            if sessao is None:
+                sessao = self.sessoes[chave] = Sessao(*chave)
+            self.sessoes.move_to_end(chave)
+
+            # Descarta as sessões usadas há mais tempo quando o pool passa do tamanho máximo
+            for antiga in list(self.sessoes)[:-1]:
+                if len(self.sessoes) <= self.tamanho_maximo:
+                    break
+                if not self.sessoes[antiga].lock.locked():
+                    self.remover(antiga)
+
+        with sessao.lock:
+            yield sessao
+
+    def fechar(self):
+        with self.lock:
+            for chave in list(self.sessoes):
+                self.remover(chave)
+
+
+pool_sessoes = PoolSessoes()
+atexit.register(pool_sessoes.fechar)
+
+
+# ******************************* GET de vários OIDs *******************************
+def tamanho_varbind(oid, tamanho_valor=64):
+    # Estimativa em bytes de um varbind na resposta: OID codificado mais espaço para o valor
+    return sum(1 if int(parte) < 128 else 3 for parte in oid.split('.')) + 8 + tamanho_valor
 
-# Funções snmpget (recupera um em específico), snmpbulkget e snmpwalk
-def snmpget(oid):
-    iterator = getCmd(
-        SnmpEngine(),
-        CommunityData(community, mpModel=0),
-        UdpTransportTarget((host, port)),
-        ContextData(),
-        ObjectType(ObjectIdentity(oid))
-    )
 
-    error_indication, error_status, error_index, var_binds = next(iterator)
+def agrupar_oids(nomes, device):
+    # Divide os OIDs escalares da tabela `oids` no menor número de PDUs que cabem no tamanho máximo do agente
+    limite = device.get('max_msg_size', maxMsgSize) - sobrecarga_mensagem(device)
+    grupos = []
+    grupo = []
+    tamanho = 0
+
+    for nome in nomes:
+        custo = tamanho_varbind(oids[nome])
+        if grupo and tamanho + custo > limite:
+            grupos.append(grupo)
+            grupo = []
+            tamanho = 0
+        grupo.append(nome)
+        tamanho += custo
+
+    if grupo:
+        grupos.append(grupo)
+
+    return grupos
+
+
+def valor_varbind(valor):
+    # noSuchObject, noSuchInstance e endOfMibView (SNMPv2c) viram None
+    if isinstance(valor, (hlapi.NoSuchObject, hlapi.NoSuchInstance, hlapi.EndOfMibView)):
+        return None
+    return valor
+
+
+def valor_simples(valor):
+    # Valor SNMP como tipo nativo do Python: OctetString vira str (um caractere por byte), OIDs a notação com pontos
+    # e os demais tipos int. Assim as amostras não dependem das classes do pysnmp para serem gravadas ou lidas
+    if valor is None:
+        return None
+    if isinstance(valor, asn1_univ.OctetString):
+        return bytes(valor).decode('latin-1')
+    if isinstance(valor, asn1_univ.ObjectIdentifier):
+        return str(valor)
+    return int(valor)
+
+
+def snmpgetgrupo(nomes, device):
+    with pool_sessoes.sessao(device) as sessao:
+        iterator = hlapi.getCmd(
+            sessao.engine,
+            sessao.auth,
+            sessao.transport,
+            hlapi.ContextData(),
+            *[hlapi.ObjectType(hlapi.ObjectIdentity(oids[nome])) for nome in nomes]
+        )
+
+        inicio = time.time()
+        error_indication, error_status, error_index, var_binds = next(iterator)
+        medir_requisicao(device, 'get', inicio, error_indication, error_status, var_binds)
 
     if error_indication:
-        print(error_indication)
         return None
     elif error_status:
-        print('%s at %s' % (
-            error_status.prettyPrint(),
-            error_index and var_binds[int(error_index) - 1][0] or '?'
-        ))
+        # tooBig: a resposta não coube em uma mensagem, divide o grupo ao meio
+        if int(error_status) == 1 and len(nomes) > 1:
+            meio = len(nomes) // 2
+            primeira, segunda = snmpgetgrupo(nomes[:meio], device), snmpgetgrupo(nomes[meio:], device)
+            return None if primeira is None or segunda is None else {**primeira, **segunda}
+
+        # noSuchName (SNMPv1): o objeto não existe no agente, repete sem ele
+        if int(error_status) == 2 and error_index:
+            ausente = nomes[int(error_index) - 1]
+            restantes = [nome for nome in nomes if nome != ausente]
+            resultado = snmpgetgrupo(restantes, device) if restantes else {}
+            return None if resultado is None else {**resultado, ausente: None}
+
         return None
-    else:
-        for var_bind in var_binds:
-            return var_bind[1]
-
-
-def snmpbulkget(oid, isint=True):
-    # Criar a lista de OIDs para todas as interfaces
-    oids_to_query = [f'{oid}.{i}' for i in range(1, if_number_object + 1)]
-
-    # Consulta SNMP usando bulkCmd
-    iterator = bulkCmd(
-        SnmpEngine(),
-        CommunityData(community, mpModel=0),
-        UdpTransportTarget((host, port)),
-        ContextData(),
-        0, 25,
-        *[
-            ObjectType(ObjectIdentity(oid)) for oid in oids_to_query
-        ]
+
+    return {nome: valor_varbind(var_bind[1]) for nome, var_bind in zip(nomes, var_binds)}
+
+
+def snmpgetmulti(nomes, device=None):
+    # GET de vários objetos escalares da tabela `oids`, retornando um dicionário nome -> valor
+    device = device or devices[dispositivoPadrao]
+    resultados = {}
+
+    for grupo in agrupar_oids(nomes, device):
+        resultado = snmpgetgrupo(grupo, device)
+        if resultado is None:
+            return None
+        resultados.update(resultado)
+
+    return resultados
+
+
+# ******************************* Leitura de tabelas *******************************
+# [max-repetitions atual, teto] de cada (dispositivo, colunas), ajustados conforme as respostas do agente
+repeticoesBulk = {}
+
+
+class LeituraTabela:
+    # Estado de uma leitura paginada de várias colunas de uma tabela (ifTable, ifXTable, ...).
+    # Cada coluna avança pelo seu próprio cursor, então ifIndex esparsos e páginas truncadas pelo agente
+    # são tratados naturalmente. No SNMPv1 cada página é um GETNEXT; a partir do v2c, um GETBULK.
+    def __init__(self, nomes, device):
+        self.nomes = nomes
+        self.device = device
+        self.v1 = device.get('version', 'v1') == 'v1'
+        self.raizes = {nome: tuple(int(parte) for parte in oids.get(nome, nome).split('.')) for nome in nomes}
+        self.cursores = dict(self.raizes)
+        self.valores = {nome: {} for nome in nomes}
+        self.chave = PoolSessoes.chave(device) + tuple(nomes)
+        if self.chave not in repeticoesBulk:
+            repeticoesBulk[self.chave] = [self.estimar_repeticoes(), maxRepetitions]
+
+    def estimar_repeticoes(self):
+        # Quantas linhas cabem em uma mensagem, supondo valores pequenos (contadores e nomes curtos)
+        limite = self.device.get('max_msg_size', maxMsgSize) - sobrecarga_mensagem(self.device)
+        custo_linha = sum(tamanho_varbind(oids.get(nome, nome) + '.1', 24) for nome in self.nomes)
+        return max(1, min(maxRepetitions, limite // custo_linha))
+
+    @property
+    def repeticoes(self):
+        return 1 if self.v1 else repeticoesBulk[self.chave][0]
+
+    def pendentes(self):
+        return [nome for nome in self.nomes if self.cursores[nome] is not None]
+
+    def pedido(self, pendentes):
+        return [hlapi.ObjectType(hlapi.ObjectIdentity('.'.join(map(str, self.cursores[nome]))))
+                for nome in pendentes]
+
+    def processar(self, linhas, pendentes):
+        avancou = False
+
+        for linha in linhas:
+            for nome, (oid, valor) in zip(pendentes, linha):
+                cursor = self.cursores[nome]
+                if cursor is None:
+                    continue
+
+                oid = tuple(oid)
+                raiz = self.raizes[nome]
+                # Fim da coluna: saiu da subárvore, fim da MIB ou um agente que não avança
+                if oid[:len(raiz)] != raiz or isinstance(valor, hlapi.EndOfMibView) or oid <= cursor:
+                    self.cursores[nome] = None
+                    continue
+
+                indice = oid[len(raiz):]
+                self.valores[nome][indice[0] if len(indice) == 1 else indice] = valor
+                self.cursores[nome] = oid
+                avancou = True
+
+        if not avancou:
+            for nome in pendentes:
+                self.cursores[nome] = None
+        elif not self.v1 and len(linhas) >= self.repeticoes:
+            # Página cheia: o agente aguenta mais linhas por requisição, até o teto já conhecido
+            ajuste = repeticoesBulk[self.chave]
+            ajuste[0] = min(ajuste[1], ajuste[0] * 2)
+
+    def tratar_erro(self, error_indication, error_status, error_index, pendentes):
+        # Retorna True quando a página deve ser repetida
+        if (error_indication or int(error_status) == 1) and self.repeticoes > 1:
+            # Timeout ou tooBig: resposta grande demais, tenta de novo com metade das linhas.
+            # No tooBig o valor que falhou vira o novo teto para não oscilar nas próximas páginas
+            ajuste = repeticoesBulk[self.chave]
+            if not error_indication:
+                ajuste[1] = ajuste[0] - 1
+            ajuste[0] = max(1, ajuste[0] // 2)
+            return True
+
+        if error_status and int(error_status) == 2 and error_index:
+            # noSuchName (SNMPv1): a coluna chegou ao fim da MIB
+            self.cursores[pendentes[int(error_index) - 1]] = None
+            return True
+
+        return False
+
+    def resultado(self):
+        # Colunas alinhadas pelos índices encontrados; células ausentes ficam None
+        indices = sorted(set().union(*[valores.keys() for valores in self.valores.values()]))
+        tabela = {'indices': indices}
+        for nome in self.nomes:
+            tabela[nome] = [self.valores[nome].get(indice) for indice in indices]
+        return tabela
+
+
+def snmptabela(nomes, device=None):
+    # Lê colunas inteiras de uma tabela (nomes da tabela `oids` ou OIDs) e retorna
+    # {'indices': [ifIndex...], nome: [valores na ordem de indices], ...}
+    device = device or devices[dispositivoPadrao]
+    leitura = LeituraTabela(nomes, device)
+
+    while leitura.pendentes():
+        pendentes = leitura.pendentes()
+        repeticoes = leitura.repeticoes
+
+        with pool_sessoes.sessao(device) as sessao:
+            if leitura.v1:
+                iterator = hlapi.nextCmd(sessao.engine, sessao.auth, sessao.transport, hlapi.ContextData(),
+                                         *leitura.pedido(pendentes), lookupMib=False)
+            else:
+                iterator = hlapi.bulkCmd(sessao.engine, sessao.auth, sessao.transport, hlapi.ContextData(),
+                                         0, repeticoes, *leitura.pedido(pendentes), lookupMib=False)
+
+            # O gerador entrega uma linha por vez; só as linhas desta página são consumidas
+            inicio = time.time()
+            respostas = list(islice(iterator, repeticoes))
+
+        if not respostas:
+            break
+
+        error_indication, error_status, error_index, _ = respostas[0]
+        medir_requisicao(device, 'getnext' if leitura.v1 else 'getbulk', inicio, error_indication, error_status,
+                         [var_bind for _, _, _, var_binds in respostas for var_bind in var_binds])
+        if error_indication or error_status:
+            if leitura.tratar_erro(error_indication, error_status, error_index, pendentes):
+                continue
+            return None
+
+        leitura.processar([var_binds for _, _, _, var_binds in respostas], pendentes)
+
+    return leitura.resultado()
+
+
+# ******************************* Backend asyncio *******************************
+class PoolSessoesAsync:
+    # Uma única SnmpEngine por laço de eventos atende todos os dispositivos de forma concorrente;
+    # credenciais e transportes de cada dispositivo são criados uma vez e reutilizados. Os alvos ficam em ordem de
+    # uso; os de dispositivos removidos ou com outra credencial saem depois de `tempo_ocioso` segundos sem uso
+    def __init__(self, tamanho_maximo=4096, tempo_ocioso=300):
+        self.tamanho_maximo = tamanho_maximo
+        self.tempo_ocioso = tempo_ocioso
+        self.engine = None
+        self.loop = None
+        self.alvos = OrderedDict()
+        self.ultimo_uso = {}
+
+    def sessao(self, device):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.fechar()
+            self.engine = hlapi.SnmpEngine()
+            cache_usm.observar(self.engine)
+            self.loop = loop
+
+        chave = PoolSessoes.chave(device)
+        alvo = self.alvos.get(chave)
+        if alvo is None:
+            transporte = snmp_asyncio.UdpTransportTarget((chave[0], chave[1]), timeout=chave[4], retries=chave[5])
+            alvo = self.alvos[chave] = (dados_autenticacao(chave[2], chave[3], transporte.transportAddr), transporte)
+        self.alvos.move_to_end(chave)
+        self.ultimo_uso[chave] = time.time()
+
+        while len(self.alvos) > self.tamanho_maximo:
+            antiga, _ = self.alvos.popitem(last=False)
+            del self.ultimo_uso[antiga]
+
+        return self.engine, alvo[0], alvo[1]
+
+    def remover_ociosas(self):
+        # Só olha o início da fila: o primeiro alvo usado recentemente encerra a varredura
+        limite = time.time() - self.tempo_ocioso
+        while self.alvos and self.ultimo_uso[next(iter(self.alvos))] < limite:
+            antiga, _ = self.alvos.popitem(last=False)
+            del self.ultimo_uso[antiga]
+
+    def fechar(self):
+        if self.engine is not None and self.engine.transportDispatcher is not None:
+            try:
+                self.engine.transportDispatcher.closeDispatcher()
+            except RuntimeError:
+                # O laço de eventos da engine anterior já foi encerrado junto com seus sockets
+                pass
+        self.engine = None
+        self.loop = None
+        self.alvos.clear()
+        self.ultimo_uso.clear()
+
+
+pool_sessoes_async = PoolSessoesAsync()
+
+
+# GET de um único objeto, usado na sondagem de agentes inativos
+async def snmpget_async(oid, device=None):
+    device = device or devices[dispositivoPadrao]
+    engine, auth, transport = pool_sessoes_async.sessao(device)
+
+    inicio = time.time()
+    error_indication, error_status, error_index, var_binds = await snmp_asyncio.getCmd(
+        engine, auth, transport, hlapi.ContextData(),
+        hlapi.ObjectType(hlapi.ObjectIdentity(oid)),
+        lookupMib=False
     )
+    medir_requisicao(device, 'get', inicio, error_indication, error_status, var_binds)
 
-    error_indication, error_status, error_index, var_binds_table = next(iterator)
+    if error_indication or error_status:
+        return None
+    return var_binds[0][1]
+
+
+async def snmpgetgrupo_async(nomes, device):
+    engine, auth, transport = pool_sessoes_async.sessao(device)
+
+    inicio = time.time()
+    error_indication, error_status, error_index, var_binds = await snmp_asyncio.getCmd(
+        engine, auth, transport, hlapi.ContextData(),
+        *[hlapi.ObjectType(hlapi.ObjectIdentity(oids[nome])) for nome in nomes],
+        lookupMib=False
+    )
+    medir_requisicao(device, 'get', inicio, error_indication, error_status, var_binds)
 
     if error_indication:
-        print(f'Error indication: {error_indication}')
         return None
     elif error_status:
-        print(f'Error status: {error_status.prettyPrint()} at {error_index}')
+        # Mesmo tratamento de tooBig e noSuchName do snmpgetgrupo
+        if int(error_status) == 1 and len(nomes) > 1:
+            meio = len(nomes) // 2
+            primeira, segunda = await asyncio.gather(
+                snmpgetgrupo_async(nomes[:meio], device),
+                snmpgetgrupo_async(nomes[meio:], device)
+            )
+            return None if primeira is None or segunda is None else {**primeira, **segunda}
+
+        if int(error_status) == 2 and error_index:
+            ausente = nomes[int(error_index) - 1]
+            restantes = [nome for nome in nomes if nome != ausente]
+            resultado = await snmpgetgrupo_async(restantes, device) if restantes else {}
+            return None if resultado is None else {**resultado, ausente: None}
+
         return None
-    else:
-        # Extrair os valores para todas as interfaces
-        if isint:
-            values_for_interfaces = [int(var_bind[1]) if var_bind[1] else 0 for var_bind in var_binds_table]
+
+    return {nome: valor_varbind(var_bind[1]) for nome, var_bind in zip(nomes, var_binds)}
+
+
+async def snmpgetmulti_async(nomes, device=None):
+    device = device or devices[dispositivoPadrao]
+    resultados = {}
+
+    respostas = await asyncio.gather(*[snmpgetgrupo_async(grupo, device) for grupo in agrupar_oids(nomes, device)])
+    for resposta in respostas:
+        if resposta is None:
+            return None
+        resultados.update(resposta)
+
+    return resultados
+
+
+async def snmptabela_async(nomes, device=None):
+    device = device or devices[dispositivoPadrao]
+    leitura = LeituraTabela(nomes, device)
+
+    while leitura.pendentes():
+        pendentes = leitura.pendentes()
+        engine, auth, transport = pool_sessoes_async.sessao(device)
+
+        inicio = time.time()
+        if leitura.v1:
+            resposta = await snmp_asyncio.nextCmd(engine, auth, transport, hlapi.ContextData(),
+                                                  *leitura.pedido(pendentes), lookupMib=False)
         else:
-            values_for_interfaces = [var_bind[1] if var_bind[1] else 0 for var_bind in var_binds_table]
+            resposta = await snmp_asyncio.bulkCmd(engine, auth, transport, hlapi.ContextData(),
+                                                  0, leitura.repeticoes, *leitura.pedido(pendentes), lookupMib=False)
+
+        error_indication, error_status, error_index, var_binds_table = resposta
+        medir_requisicao(device, 'getnext' if leitura.v1 else 'getbulk', inicio, error_indication, error_status,
+                         [var_bind for var_binds in var_binds_table for var_bind in var_binds])
+        if error_indication or error_status:
+            if leitura.tratar_erro(error_indication, error_status, error_index, pendentes):
+                continue
+            return None
 
-        return values_for_interfaces
+        leitura.processar(var_binds_table, pendentes)
 
+    return leitura.resultado()
 
-def snmpwalk(oid):
-    iterator = nextCmd(
-        SnmpEngine(),
-        CommunityData(community, mpModel=0),
-        UdpTransportTarget((host, port)),
-        ContextData(),
-        ObjectType(ObjectIdentity(oid)),
-        lexicographicMode=False  # Desativa o modo lexicográfico para um walk
-    )
 
-    results = []
+# ******************************* Taxas *******************************
+# Contadores convertidos em taxa por segundo e a largura de cada um em bits
+counterBits = {
+    'ifInOctets': 32,
+    'ifOutOctets': 32,
+    'ifHCInOctets': 64,
+    'ifHCOutOctets': 64,
+    'ifInErrors': 32,
+    'ifInUcastPkts': 32,
+    'ifInNUcastPkts': 32,
+    'ipForwDatagrams': 32,
+}
 
-    for error_indication, error_status, error_index, var_binds_table in iterator:
-        if error_indication:
-            print(error_indication)
+
+def taxas_contador(anterior, atual, bits):
+    # Taxa por segundo de cada índice entre duas leituras (timestamp, índices, valores) de um contador.
+    # A diferença é feita módulo 2^bits, o que corrige a volta do contador; índices sem leitura anterior ficam NaN.
+    # Células sem valor (None) contam como índices ausentes naquela leitura
+    t0, indices0, valores0 = anterior
+    t1, indices1, valores1 = atual
+    if None in valores0:
+        presentes = [(indice, valor) for indice, valor in zip(indices0, valores0) if valor is not None]
+        indices0, valores0 = [indice for indice, _ in presentes], [valor for _, valor in presentes]
+    if None in valores1:
+        presentes = [valor is not None for valor in valores1]
+        parciais = taxas_contador((t0, indices0, valores0),
+                                  (t1, [indice for indice, presente in zip(indices1, presentes) if presente],
+                                   [valor for valor in valores1 if valor is not None]), bits)
+        if np is not None:
+            resultado = np.full(len(indices1), np.nan)
+            resultado[np.asarray(presentes, dtype=bool)] = parciais
+            return resultado
+        parciais = iter(parciais)
+        return [next(parciais) if presente else float('nan') for presente in presentes]
+
+    intervalo = t1 - t0
+    mascara = 2 ** bits - 1
+
+    if np is not None:
+        v1 = np.asarray(valores1, dtype=np.uint64)
+        validos = None
+        if indices0 == indices1:
+            v0 = np.asarray(valores0, dtype=np.uint64)
+        else:
+            posicoes_anteriores = {indice: i for i, indice in enumerate(indices0)}
+            posicoes = np.array([posicoes_anteriores.get(indice, -1) for indice in indices1], dtype=np.int64)
+            validos = posicoes >= 0
+            v0 = np.asarray(valores0, dtype=np.uint64)[posicoes[validos]]
+            v1 = v1[validos]
+
+        # Em uint64 a subtração já é módulo 2^64; a máscara reduz para 2^32 nos contadores de 32 bits
+        delta = (v1 - v0) & np.uint64(mascara)
+        taxas = delta.astype(np.float64) / intervalo
+        if bits == 64:
+            # Um contador de 64 bits não dá a volta entre duas coletas: é uma reinicialização
+            taxas[delta > np.uint64(2 ** 63)] = np.nan
+
+        if validos is None:
+            return taxas
+        resultado = np.full(len(indices1), np.nan)
+        resultado[validos] = taxas
+        return resultado
+
+    anteriores = dict(zip(indices0, valores0))
+    taxas = []
+    for indice, valor in zip(indices1, valores1):
+        if indice not in anteriores:
+            taxas.append(float('nan'))
+            continue
+        delta = (valor - anteriores[indice]) & mascara
+        taxas.append(float('nan') if bits == 64 and delta > 2 ** 63 else delta / intervalo)
+    return taxas
+
+
+def soma_taxas(taxas):
+    # Soma ignorando as interfaces sem taxa (NaN); None quando nenhuma tem taxa ainda ou não há taxas
+    if taxas is None:
+        return None
+    if np is not None and isinstance(taxas, np.ndarray):
+        validas = taxas[~np.isnan(taxas)]
+        return float(validas.sum()) if len(validas) else None
+
+    validas = [taxa for taxa in taxas if taxa == taxa]
+    return sum(validas) if validas else None
+
+
+class MotorTaxas:
+    # Guarda a leitura anterior de cada contador de cada dispositivo (por ifIndex) e calcula as taxas por
+    # segundo a partir dos timestamps reais das amostras. Se o sysUpTime voltar, o agente reiniciou e os
+    # contadores recomeçaram do zero: as taxas dessa rodada são descartadas e a amostra vira a nova base.
+    def __init__(self, contadores=None):
+        self.contadores = contadores or counterBits
+        self.anteriores = {}
+        self.uptimes = {}
+        self.lock = threading.Lock()
+
+    def calcular(self, dispositivo, amostra):
+        uptime = int(amostra['sysUpTime'])
+        taxas = {}
+
+        with self.lock:
+            reiniciou = uptime < self.uptimes.get(dispositivo, 0)
+            self.uptimes[dispositivo] = uptime
+
+            for nome, bits in self.contadores.items():
+                if amostra.get(nome) is None:
+                    continue
+
+                # Escalares são tratados como uma tabela de um único índice, com o instante da sua própria leitura
+                if isinstance(amostra[nome], list):
+                    timestamp = amostra['timestamp']
+                    atual = (timestamp, amostra['ifIndex'], amostra[nome])
+                else:
+                    timestamp = amostra.get('timestampEscalares', amostra['timestamp'])
+                    atual = (timestamp, [0], [amostra[nome]])
+
+                anterior = self.anteriores.get((dispositivo, nome))
+                self.anteriores[(dispositivo, nome)] = atual
+
+                if anterior is None or reiniciou or timestamp <= anterior[0]:
+                    taxas[nome] = [float('nan')] * len(atual[1])
+                else:
+                    taxas[nome] = taxas_contador(anterior, atual, bits)
+
+        return taxas
+
+    def remover(self, dispositivo):
+        with self.lock:
+            self.uptimes.pop(dispositivo, None)
+            for chave in [chave for chave in self.anteriores if chave[0] == dispositivo]:
+                del self.anteriores[chave]
+
+
+# ******************************* Buffers em memória *******************************
+class BufferCircular:
+    # Série (timestamp, valor) de tamanho fixo em memória contígua de floats: 16 bytes por ponto mais uma folga.
+    # Quando a folga acaba os pontos mais recentes voltam para o início do buffer, assim a janela é sempre
+    # contígua e visoes() devolve fatias sem cópia. As fatias apontam para o próprio buffer e mudam quando ele é
+    # compactado, então só valem enquanto nenhum ponto novo é adicionado; fora do coletor use copia()
+    def __init__(self, capacidade, folga=0.25):
+        self.capacidade = capacidade
+        tamanho = capacidade + max(1, int(capacidade * folga))
+        if np is not None:
+            self.timestamps = np.zeros(tamanho)
+            self.valores = np.zeros(tamanho)
+        else:
+            self.timestamps = array('d', bytes(8 * tamanho))
+            self.valores = array('d', bytes(8 * tamanho))
+        self.inicio = 0
+        self.fim = 0
+
+    def __len__(self):
+        return self.fim - self.inicio
+
+    def adicionar(self, timestamp, valor):
+        if self.fim == len(self.timestamps):
+            mantidos = self.capacidade - 1
+            self.timestamps[:mantidos] = self.timestamps[self.fim - mantidos:self.fim]
+            self.valores[:mantidos] = self.valores[self.fim - mantidos:self.fim]
+            self.inicio, self.fim = 0, mantidos
+
+        self.timestamps[self.fim] = timestamp
+        self.valores[self.fim] = valor
+        self.fim += 1
+        if self.fim - self.inicio > self.capacidade:
+            self.inicio += 1
+
+    def visoes(self, ultimos=None):
+        # Fatias (timestamps, valores) dos últimos pontos, em ordem cronológica
+        inicio = self.inicio if ultimos is None else max(self.inicio, self.fim - ultimos)
+        if np is not None:
+            return self.timestamps[inicio:self.fim], self.valores[inicio:self.fim]
+        return memoryview(self.timestamps)[inicio:self.fim], memoryview(self.valores)[inicio:self.fim]
+
+    def copia(self, ultimos=None):
+        # Cópia (timestamps, valores) dos últimos pontos, independente das próximas adições
+        timestamps, valores = self.visoes(ultimos)
+        if np is not None:
+            return timestamps.copy(), valores.copy()
+        return array('d', timestamps), array('d', valores)
+
+
+# ******************************* Séries temporais *******************************
+def amostra_json(amostra):
+    # Amostras são gravadas em JSON, só com números, textos e listas (as taxas em arrays NumPy viram listas). Com
+    # pickle, quem pudesse escrever no banco executaria código no processo da interface ao ser lido
+    def converter(valor):
+        if hasattr(valor, 'tolist'):
+            return valor.tolist()
+        raise TypeError(f'{type(valor).__name__} não pode ser gravado na amostra')
+
+    return json.dumps(amostra, default=converter)
+
+
+class ArmazenamentoSeries:
+    # Histórico em disco de todas as métricas, por dispositivo e interface (0 para métricas do dispositivo todo).
+    # SQLite em modo WAL: uma thread de escrita grava as amostras de cada rodada em uma única transação e os
+    # callbacks leem por conexões próprias sem bloquear a escrita. As amostras brutas são consolidadas em
+    # agregados de 1 minuto e de 1 hora (mínimo, máximo, soma e contagem) e cada resolução tem sua retenção.
+    resolucoes = (60, 3600)
+
+    def __init__(self, caminho, retencao=None, atraso=60):
+        self.caminho = caminho
+        # Retenção em segundos de cada resolução (0 = amostras brutas)
+        self.retencao = retencao or {0: 2 * 86400, 60: 30 * 86400, 3600: 730 * 86400}
+        # Os buckets só são consolidados depois que nenhuma amostra atrasada pode mais chegar
+        self.atraso = atraso
+        self.fila = queue.Queue()
+        self.locais = threading.local()
+        self.parar = threading.Event()
+        self.thread = None
+
+    def conectar(self):
+        conexao = sqlite3.connect(self.caminho, timeout=30)
+        conexao.execute('PRAGMA journal_mode=WAL')
+        conexao.execute('PRAGMA synchronous=NORMAL')
+        conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS amostras (
+                dispositivo TEXT, metrica TEXT, interface INTEGER, timestamp REAL, valor REAL,
+                PRIMARY KEY (dispositivo, metrica, interface, timestamp)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS amostras_timestamp ON amostras (timestamp);
+            CREATE TABLE IF NOT EXISTS agregados (
+                resolucao INTEGER, dispositivo TEXT, metrica TEXT, interface INTEGER, inicio REAL,
+                minimo REAL, maximo REAL, soma REAL, contagem INTEGER,
+                PRIMARY KEY (resolucao, dispositivo, metrica, interface, inicio)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS agregados_inicio ON agregados (resolucao, inicio);
+            CREATE TABLE IF NOT EXISTS consolidacao (resolucao INTEGER PRIMARY KEY, ate REAL);
+            CREATE TABLE IF NOT EXISTS ultimas (dispositivo TEXT PRIMARY KEY, timestamp REAL, amostra TEXT);
+            CREATE TABLE IF NOT EXISTS dispositivos (nome TEXT PRIMARY KEY, configuracao TEXT);
+            CREATE TABLE IF NOT EXISTS estados (dispositivo TEXT PRIMARY KEY, ativo INTEGER, desde REAL);
+            CREATE TABLE IF NOT EXISTS eventos (dispositivo TEXT, timestamp REAL, tipo TEXT, interface INTEGER);
+            CREATE INDEX IF NOT EXISTS eventos_dispositivo ON eventos (dispositivo, timestamp);
+        """)
+        return conexao
+
+    def conexao_leitura(self):
+        # Uma conexão por thread, já que conexões SQLite não podem ser compartilhadas entre threads. Além das
+        # leituras, é usada para os raros cadastros de dispositivos feitos pela interface
+        conexao = getattr(self.locais, 'conexao', None)
+        if conexao is None:
+            conexao = self.locais.conexao = self.conectar()
+        return conexao
+
+    def gravar(self, dispositivo, timestamp, pontos):
+        # pontos: [(metrica, interface, valor), ...]; a gravação de fato acontece na thread de escrita
+        self.fila.put(('pontos', [(dispositivo, metrica, interface, timestamp, valor)
+                                  for metrica, interface, valor in pontos]))
+
+    def gravar_amostra(self, dispositivo, amostra):
+        # Última amostra completa do dispositivo, lida pela interface quando a coleta roda em outro processo
+        self.fila.put(('amostra', (dispositivo, amostra)))
+
+    def gravar_eventos(self, eventos):
+        # eventos: [(dispositivo, timestamp, tipo, interface), ...] vindos do receptor de traps
+        self.fila.put(('eventos', eventos))
+
+    def ultimo_evento(self, dispositivo, tipos):
+        linha = self.conexao_leitura().execute(f"""
+            SELECT tipo FROM eventos WHERE dispositivo = ? AND tipo IN ({', '.join('?' * len(tipos))})
+            ORDER BY timestamp DESC LIMIT 1
+        """, (dispositivo, *tipos)).fetchone()
+        return linha[0] if linha else None
+
+    def consultar_eventos(self, dispositivo, inicio, fim):
+        return self.conexao_leitura().execute("""
+            SELECT timestamp, tipo, interface FROM eventos
+            WHERE dispositivo = ? AND timestamp BETWEEN ? AND ? ORDER BY timestamp
+        """, (dispositivo, inicio, fim)).fetchall()
+
+    def gravar_estado(self, dispositivo, estado):
+        self.fila.put(('estado', (dispositivo, estado)))
+
+    def estado(self, dispositivo):
+        linha = self.conexao_leitura().execute('SELECT ativo, desde FROM estados WHERE dispositivo = ?',
+                                               (dispositivo,)).fetchone()
+        return None if linha is None else {'ativo': bool(linha[0]), 'desde': linha[1]}
+
+    def estados(self):
+        # Estado de todos os dispositivos em uma única consulta, para a visão da frota
+        linhas = self.conexao_leitura().execute('SELECT dispositivo, ativo, desde FROM estados').fetchall()
+        return {dispositivo: {'ativo': bool(ativo), 'desde': desde} for dispositivo, ativo, desde in linhas}
+
+    def ultima_amostra(self, dispositivo, desde=0):
+        # (timestamp, amostra) da última amostra gravada; a amostra só é lida do banco se for mais nova que 'desde'
+        linha = self.conexao_leitura().execute(
+            'SELECT timestamp, CASE WHEN timestamp > ? THEN amostra END FROM ultimas WHERE dispositivo = ?',
+            (desde, dispositivo)
+        ).fetchone()
+        if linha is None or linha[1] is None:
+            return None if linha is None else (linha[0], None)
+        try:
+            return linha[0], json.loads(linha[1])
+        except ValueError:
+            # Linha gravada por uma versão anterior, que usava pickle; é substituída na próxima coleta
+            return linha[0], None
+
+    def ultimas_amostras(self, desde):
+        # ultima_amostra de todos os dispositivos em uma única consulta. `desde` é {dispositivo: timestamp} e só as
+        # amostras mais novas que o instante de cada dispositivo são lidas do banco e decodificadas
+        linhas = self.conexao_leitura().execute("""
+            SELECT u.dispositivo, u.timestamp, CASE WHEN u.timestamp > COALESCE(d.value, 0) THEN u.amostra END
+            FROM ultimas u LEFT JOIN json_each(?) d ON d.key = u.dispositivo
+        """, (json.dumps(desde),)).fetchall()
+        resultado = {}
+        for dispositivo, timestamp, amostra in linhas:
+            try:
+                resultado[dispositivo] = (timestamp, None if amostra is None else json.loads(amostra))
+            except ValueError:
+                resultado[dispositivo] = (timestamp, None)
+        return resultado
+
+    def ultimos_pontos(self, dispositivo, metrica, quantidade, interface=0):
+        linhas = self.conexao_leitura().execute("""
+            SELECT timestamp, valor FROM amostras
+            WHERE dispositivo = ? AND metrica = ? AND interface = ?
+            ORDER BY timestamp DESC LIMIT ?
+        """, (dispositivo, metrica, interface, quantidade)).fetchall()
+        linhas.reverse()
+        return [linha[0] for linha in linhas], [linha[1] for linha in linhas]
+
+    def registrar_dispositivo(self, nome, device):
+        conexao = self.conexao_leitura()
+        with conexao:
+            conexao.execute('INSERT OR REPLACE INTO dispositivos VALUES (?, ?)', (nome, json.dumps(device)))
+
+    def registrar_dispositivos(self, dispositivos):
+        # Cadastro em lote (importação e descoberta) em uma única transação
+        conexao = self.conexao_leitura()
+        with conexao:
+            conexao.executemany('INSERT OR REPLACE INTO dispositivos VALUES (?, ?)',
+                                [(nome, json.dumps(device)) for nome, device in dispositivos.items()])
+
+    def dispositivos(self):
+        linhas = self.conexao_leitura().execute('SELECT nome, configuracao FROM dispositivos').fetchall()
+        return {nome: json.loads(configuracao) for nome, configuracao in linhas}
+
+    def consolidar(self, conexao, agora):
+        for resolucao in self.resolucoes:
+            ate = (agora - self.atraso) // resolucao * resolucao
+            linha = conexao.execute('SELECT ate FROM consolidacao WHERE resolucao = ?', (resolucao,)).fetchone()
+
+            if resolucao == 60:
+                origem = 'SELECT MIN(timestamp) FROM amostras'
+                consulta = """
+                    INSERT OR REPLACE INTO agregados
+                    SELECT 60, dispositivo, metrica, interface, CAST(timestamp / 60 AS INTEGER) * 60,
+                           MIN(valor), MAX(valor), SUM(valor), COUNT(*)
+                    FROM amostras WHERE timestamp >= ? AND timestamp < ?
+                    GROUP BY dispositivo, metrica, interface, CAST(timestamp / 60 AS INTEGER)
+                """
+            else:
+                origem = 'SELECT MIN(inicio) FROM agregados WHERE resolucao = 60'
+                consulta = """
+                    INSERT OR REPLACE INTO agregados
+                    SELECT 3600, dispositivo, metrica, interface, CAST(inicio / 3600 AS INTEGER) * 3600,
+                           MIN(minimo), MAX(maximo), SUM(soma), SUM(contagem)
+                    FROM agregados WHERE resolucao = 60 AND inicio >= ? AND inicio < ?
+                    GROUP BY dispositivo, metrica, interface, CAST(inicio / 3600 AS INTEGER)
+                """
+
+            desde = linha[0] if linha else conexao.execute(origem).fetchone()[0]
+            if desde is None or desde >= ate:
+                continue
+
+            desde = desde // resolucao * resolucao
+            with conexao:
+                conexao.execute(consulta, (desde, ate))
+                conexao.execute('INSERT OR REPLACE INTO consolidacao VALUES (?, ?)', (resolucao, ate))
+
+    def aplicar_retencao(self, conexao, agora):
+        with conexao:
+            conexao.execute('DELETE FROM amostras WHERE timestamp < ?', (agora - self.retencao[0],))
+            conexao.execute('DELETE FROM eventos WHERE timestamp < ?', (agora - self.retencao[60],))
+            for resolucao in self.resolucoes:
+                conexao.execute('DELETE FROM agregados WHERE resolucao = ? AND inicio < ?',
+                                (resolucao, agora - self.retencao[resolucao]))
+
+    def executar(self):
+        conexao = self.conectar()
+        proxima_manutencao = 0
+
+        while not self.parar.is_set() or not self.fila.empty():
+            try:
+                itens = [self.fila.get(timeout=1)]
+            except queue.Empty:
+                itens = []
+
+            # Junta tudo o que chegou na rodada em uma única transação
+            while True:
+                try:
+                    itens.append(self.fila.get_nowait())
+                except queue.Empty:
+                    break
+
+            linhas = []
+            ultimas = {}
+            estados = {}
+            eventos = []
+            for tipo, dados in itens:
+                if tipo == 'pontos':
+                    linhas += dados
+                elif tipo == 'amostra':
+                    ultimas[dados[0]] = dados[1]
+                elif tipo == 'estado':
+                    estados[dados[0]] = dados[1]
+                else:
+                    eventos += dados
+
+            if linhas or ultimas or estados or eventos:
+                with conexao:
+                    conexao.executemany('INSERT OR REPLACE INTO amostras VALUES (?, ?, ?, ?, ?)', linhas)
+                    conexao.executemany('INSERT OR REPLACE INTO ultimas VALUES (?, ?, ?)', [
+                        (dispositivo, amostra['timestamp'], amostra_json(amostra))
+                        for dispositivo, amostra in ultimas.items()
+                    ])
+                    conexao.executemany('INSERT OR REPLACE INTO estados VALUES (?, ?, ?)', [
+                        (dispositivo, estado['ativo'], estado['desde']) for dispositivo, estado in estados.items()
+                    ])
+                    conexao.executemany('INSERT INTO eventos VALUES (?, ?, ?, ?)', eventos)
+
+            agora = time.time()
+            if agora >= proxima_manutencao:
+                self.consolidar(conexao, agora)
+                self.aplicar_retencao(conexao, agora)
+                proxima_manutencao = agora + 60
+
+        conexao.close()
+
+    def consultar(self, dispositivo, metrica, inicio, fim, interface=0, intervalo=None, max_pontos=1500):
+        # Série (timestamps, valores) no período pedido, na resolução mais fina que cobre o início do
+        # período e não passa de max_pontos (um dia cabe na resolução de 1 minuto); agregados retornam a média de
+        # cada bucket. `intervalo` é a periodicidade de coleta do dispositivo, que dá o número de amostras brutas
+        conexao = self.conexao_leitura()
+        agora = time.time()
+        duracao = fim - inicio
+        chave = (dispositivo, metrica, interface)
+
+        if inicio >= agora - self.retencao[0] and duracao / max(intervalo or intervalTime, 1) <= max_pontos:
+            linhas = conexao.execute("""
+                SELECT timestamp, valor FROM amostras
+                WHERE dispositivo = ? AND metrica = ? AND interface = ? AND timestamp BETWEEN ? AND ?
+                ORDER BY timestamp
+            """, (*chave, inicio, fim)).fetchall()
+            return [linha[0] for linha in linhas], [linha[1] for linha in linhas]
+
+        resolucao = next((resolucao for resolucao in self.resolucoes
+                          if duracao / resolucao <= max_pontos and inicio >= agora - self.retencao[resolucao]),
+                         self.resolucoes[-1])
+        consolidado = dict(conexao.execute('SELECT resolucao, ate FROM consolidacao').fetchall())
+        ate = consolidado.get(resolucao, 0)
+        ate_minuto = max(consolidado.get(60, 0), ate)
+
+        # Buckets já consolidados vêm prontos; os mais recentes, ainda abertos, são montados na hora a partir dos
+        # agregados de 1 minuto e das amostras brutas, então o fim do período nunca fica vazio
+        linhas = conexao.execute("""
+            SELECT inicio, soma / contagem FROM agregados
+            WHERE resolucao = ? AND dispositivo = ? AND metrica = ? AND interface = ? AND inicio BETWEEN ? AND ?
+              AND inicio < ?
+            ORDER BY inicio
+        """, (resolucao, *chave, inicio, fim, ate)).fetchall()
+        linhas += conexao.execute("""
+            SELECT CAST(instante / ? AS INTEGER) * ?, SUM(soma) / SUM(contagem) FROM (
+                SELECT inicio AS instante, soma, contagem FROM agregados
+                WHERE resolucao = 60 AND dispositivo = ? AND metrica = ? AND interface = ?
+                  AND inicio >= ? AND inicio < ?
+                UNION ALL
+                SELECT timestamp, valor, 1 FROM amostras
+                WHERE dispositivo = ? AND metrica = ? AND interface = ? AND timestamp >= ? AND timestamp <= ?
+            ) GROUP BY 1 ORDER BY 1
+        """, (resolucao, resolucao, *chave, max(inicio, ate), ate_minuto, *chave, max(inicio, ate_minuto),
+              fim)).fetchall()
+
+        return [linha[0] for linha in linhas], [linha[1] for linha in linhas]
+
+    def iniciar(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.executar, name='armazenamento', daemon=True)
+            self.thread.start()
+
+    def finalizar(self):
+        self.parar.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+# ******************************* Coletor *******************************
+# União de todos os objetos que as métricas e o painel de informações precisam
+oids_sistema = ['sysDescr', 'sysObjectID', 'sysUpTime', 'sysContact', 'sysName', 'sysLocation', 'sysServices']
+# Objetos do grupo system que quase nunca mudam e ficam no inventário do dispositivo
+oids_inventario = ['sysDescr', 'sysObjectID', 'sysContact', 'sysName', 'sysLocation', 'sysServices']
+oids_escalares = ['icmpInEchoReps', 'ipInHdrErrors', 'ipInAddrErrors', 'ipInUnknownProtos', 'ipInReceives',
+                  'ipForwDatagrams']
+oids_tabelas = ['ifInErrors', 'ifInUcastPkts', 'ifInNUcastPkts', 'ifSpeed', 'ifHighSpeed']
+# Contadores de bytes: os de 64 bits da ifXTable são preferidos onde o agente os suporta
+oids_octetos_32 = ['ifInOctets', 'ifOutOctets']
+oids_octetos_64 = ['ifHCInOctets', 'ifHCOutOctets']
+
+
+def versao_inventario(inventario):
+    # Hash do conteúdo exibido no painel estático. Não depende de contador nem de processo, então um dispositivo
+    # que muda de processo de coleta, ou um coletor reiniciado, mantém a versão enquanto o inventário for o mesmo
+    conteudo = [inventario[nome] for nome in oids_inventario] + [inventario['ifNumber']]
+    conteudo += [valor for indice in sorted(inventario['ifName']) for valor in (indice, inventario['ifName'][indice])]
+    texto = '\x00'.join('\x01' if valor is None else str(valor) for valor in conteudo)
+    return hashlib.md5(texto.encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+
+
+class Coletor:
+    # Consulta todos os dispositivos concorrentemente em um laço asyncio numa thread de fundo e guarda a última
+    # amostra de cada um. Cada dispositivo é coletado uma vez por intervalo, com no máximo `concorrencia` coletas
+    # simultâneas e `timeout` segundos por coleta, então um agente lento ou inativo não atrasa os demais.
+    # Os callbacks do Dash apenas leem as amostras, nunca fazem requisições SNMP.
+    def __init__(self, dispositivos, concorrencia=100, timeout=10, armazenamento=None,
+                 capacidade_buffer=capacidadeBuffer, ttl_inventario=ttlInventario, alertas=None):
+        self.dispositivos = dispositivos
+        self.concorrencia = concorrencia
+        self.timeout = timeout
+        self.ttl_inventario = ttl_inventario
+        self.inventarios = {}
+        self.armazenamento = armazenamento
+        self.alertas = alertas
+        self.capacidade_buffer = capacidade_buffer
+        # Séries recentes das métricas de cada dispositivo: buffers[nome][metrica] -> BufferCircular
+        self.buffers = {}
+        self.amostras = {}
+        self.motor_taxas = MotorTaxas()
+        self.capacidades = {}
+        # Agenda de coletas: heap de (instante, nome). proximas_coletas guarda o instante válido de cada
+        # dispositivo; entradas do heap com outro instante estão obsoletas e são descartadas ao sair do heap
+        self.agenda = []
+        self.proximas_coletas = {}
+        self.falhas = {}
+        # Dispositivos cuja última coleta falhou, mas que responderam à sondagem seguinte
+        self.respondendo = set()
+        # Estado de cada agente para a interface: {'ativo': bool, 'desde': timestamp da última mudança}
+        self.estados = {}
+        self.visualizados = {}
+        self.em_andamento = set()
+        self.lock = threading.Lock()
+        self.parar = threading.Event()
+        self.thread = None
+        self.loop = None
+
+    async def coletar(self, device):
+        # Cada contador é dividido pelo intervalo entre as suas próprias leituras: os escalares usam o instante do
+        # GET dos escalares e a tabela o instante da sua leitura, depois do inventário e da sondagem do HC
+        timestamp_escalares = time.time()
+
+        # A cada coleta só o sysUpTime, o ifTableLastChange e os contadores IP/ICMP, no menor número de PDUs;
+        # o restante do grupo system, o ifNumber e os nomes das interfaces vêm do inventário
+        with medir_etapa(device, 'escalares'):
+            escalares = await snmpgetmulti_async(['sysUpTime', 'ifTableLastChange'] + oids_escalares, device)
+        if escalares is None or escalares['sysUpTime'] is None:
             return None
-        elif error_status:
-            print('%s at %s' % (
-                error_status.prettyPrint(),
-                error_index and var_binds_table[int(error_index) - 1][0] or '?'
-            ))
+
+        inventario = await self.inventario(device, escalares)
+        if inventario is None:
+            return None
+
+        capacidade = await self.capacidade_hc(device)
+        if capacidade is None:
             return None
+
+        colunas = list(oids_tabelas)
+        if capacidade['hc']:
+            colunas += oids_octetos_64
+        if capacidade['hc'] != capacidade['interfaces']:
+            colunas += oids_octetos_32
+
+        # Todas as colunas de interface em uma única leitura paginada da ifTable/ifXTable
+        timestamp = time.time()
+        with medir_etapa(device, 'interfaces'):
+            tabela = await snmptabela_async(colunas, device)
+        if tabela is None:
+            return None
+
+        # Interfaces novas ou removidas: o inventário é relido agora e a capacidade é sondada na próxima coleta.
+        # Depois da releitura o conjunto lido aqui vira a referência, então um agente cujas colunas de nome não
+        # cobrem todas as linhas da ifTable não é relido a cada coleta
+        if set(tabela['indices']) != inventario['ifIndex']:
+            inventario = await self.inventario(device, escalares, forcar=True)
+            if inventario is None:
+                return None
+            inventario['ifIndex'] = set(tabela['indices'])
+        if capacidade['interfaces'] is not None and set(tabela['indices']) != capacidade['interfaces']:
+            self.capacidades.pop(PoolSessoes.chave(device), None)
+
+        amostra = {
+            'timestamp': timestamp,
+            'timestampEscalares': timestamp_escalares,
+            'versaoInventario': inventario['versao'],
+            'ifNumber': inventario['ifNumber'],
+            'ifIndex': tabela['indices'],
+            'ifName': [inventario['ifName'].get(indice) for indice in tabela['indices']],
+            'suporteHC': [indice in capacidade['hc'] for indice in tabela['indices']],
+            'sysUpTime': int(escalares['sysUpTime'])
+        }
+        for nome in oids_inventario:
+            amostra[nome] = inventario[nome]
+        for nome in oids_escalares:
+            amostra[nome] = None if escalares[nome] is None else int(escalares[nome])
+        # Células de contador ausentes na leitura ficam None e não entram no cálculo das taxas; as demais colunas
+        # (velocidades) ficam 0
+        for nome in colunas:
+            ausente = None if nome in counterBits else 0
+            amostra[nome] = [int(valor) if valor is not None else ausente for valor in tabela[nome]]
+
+        # Só o sysUpTime e a tabela de interfaces são obrigatórios; escalares que o agente não implementa
+        # (noSuchObject, noSuchName) ficam None e as métricas que dependem deles não são calculadas
+        return amostra
+
+    async def inventario(self, device, escalares, forcar=False):
+        # Dados estáticos do dispositivo, relidos apenas quando o sysUpTime volta (reinício do agente), quando o
+        # ifTableLastChange muda ou quando o TTL expira. A versão do inventário é um hash do conteúdo
+        chave = PoolSessoes.chave(device)
+        anterior = self.inventarios.get(chave)
+        sys_up_time = int(escalares['sysUpTime'])
+        if_table_last_change = escalares['ifTableLastChange']
+        if if_table_last_change is not None:
+            if_table_last_change = int(if_table_last_change)
+
+        if (anterior is not None and not forcar and time.time() < anterior['expira']
+                and sys_up_time >= anterior['sysUpTime'] and if_table_last_change == anterior['ifTableLastChange']):
+            anterior['sysUpTime'] = sys_up_time
+            return anterior
+
+        with medir_etapa(device, 'inventario'):
+            estaticos = await snmpgetmulti_async(oids_inventario + ['ifNumber'], device)
+            if estaticos is None:
+                return None
+
+            # ifDescr cobre os agentes sem a ifXTable (ou sem ifName)
+            tabela = await snmptabela_async(['ifName', 'ifDescr'], device)
+            if tabela is None:
+                return None
+
+        inventario = {nome: valor_simples(estaticos[nome]) for nome in oids_inventario}
+        inventario.update({
+            'expira': time.time() + self.ttl_inventario,
+            'sysUpTime': sys_up_time,
+            'ifTableLastChange': if_table_last_change,
+            'ifNumber': int(estaticos['ifNumber']) if estaticos['ifNumber'] is not None else len(tabela['indices']),
+            'ifIndex': set(tabela['indices']),
+            'ifName': {indice: valor_simples(if_name or if_descr)
+                       for indice, if_name, if_descr in zip(tabela['indices'], tabela['ifName'], tabela['ifDescr'])}
+        })
+        inventario['versao'] = versao_inventario(inventario)
+        self.inventarios[chave] = inventario
+
+        # Depois de um reinício as interfaces podem ter mudado de capacidade
+        if anterior is not None and sys_up_time < anterior['sysUpTime']:
+            self.capacidades.pop(chave, None)
+
+        return inventario
+
+    async def capacidade_hc(self, device):
+        # Interfaces do dispositivo que suportam ifHCInOctets/ifHCOutOctets. A sondagem roda uma vez e fica em cache;
+        # no SNMPv1 não existem contadores de 64 bits, então nem é feita
+        chave = PoolSessoes.chave(device)
+        capacidade = self.capacidades.get(chave)
+
+        if capacidade is None:
+            if device.get('version', 'v1') == 'v1':
+                capacidade = {'interfaces': None, 'hc': set()}
+            else:
+                with medir_etapa(device, 'capacidade'):
+                    tabela = await snmptabela_async(['ifInOctets', 'ifHCInOctets'], device)
+                if tabela is None:
+                    return None
+                capacidade = {
+                    'interfaces': set(tabela['indices']),
+                    'hc': {indice for indice, valor in zip(tabela['indices'], tabela['ifHCInOctets'])
+                           if valor is not None}
+                }
+            self.capacidades[chave] = capacidade
+
+        return capacidade
+
+    async def sondar(self, device):
+        # Uma única requisição, sem retransmissões, para saber se um agente inativo voltou
+        with medir_etapa(device, 'sondagem'):
+            return await snmpget_async(oids['sysUpTime'], dict(device, retries=0)) is not None
+
+    async def coletar_dispositivo(self, nome, device, semaforo):
+        async with semaforo:
+            inativo = self.falhas.get(nome, 0) >= limiteFalhas
+            motivo = 'sem_resposta'
+            try:
+                # Agente inativo: só faz a coleta completa depois que a sondagem responder
+                if inativo and not await asyncio.wait_for(self.sondar(device), self.timeout):
+                    amostra = None
+                else:
+                    amostra = await asyncio.wait_for(self.coletar(device), self.timeout)
+                if amostra is not None:
+                    try:
+                        amostra['taxas'] = self.motor_taxas.calcular(nome, amostra)
+                        amostra['metricas'] = metricas_amostra(amostra)
+                    except Exception as e:
+                        # O agente respondeu: um erro no cálculo das métricas não muda o estado do dispositivo
+                        print(f'Falha no cálculo das métricas de {nome}: {e}')
+                        amostra.setdefault('taxas', {})
+                        amostra['metricas'] = []
+            except asyncio.TimeoutError:
+                amostra, motivo = None, 'timeout'
+            except Exception as e:
+                print(f'Falha na coleta de {nome}: {e}')
+                amostra, motivo = None, 'excecao'
+
+            if amostra is None:
+                metricas.contar('coleta_falhas_total', dispositivo=nome, motivo=motivo)
+                # A coleta de um agente ativo só conta para o disjuntor se a sondagem também falhar: um timeout
+                # causado pelo próprio gerente sobrecarregado não deixa o agente inativo nem aumenta o intervalo
+                if not inativo:
+                    try:
+                        if await asyncio.wait_for(self.sondar(device), self.timeout):
+                            self.respondendo.add(nome)
+                    except asyncio.TimeoutError:
+                        pass
+                return None
+
+        self.registrar(nome, amostra)
+        return amostra
+
+    def registrar(self, nome, amostra):
+        # Guarda a amostra, alimenta os buffers em memória e envia as métricas para o histórico
+        with self.lock:
+            self.amostras[nome] = amostra
+            buffers = self.buffers.setdefault(nome, {})
+            for metrica, interface, valor in amostra['metricas']:
+                if interface == 0:
+                    if metrica not in buffers:
+                        buffers[metrica] = BufferCircular(self.capacidade_buffer)
+                    buffers[metrica].adicionar(amostra['timestamp'], valor)
+        if self.armazenamento is not None:
+            self.armazenamento.gravar(nome, amostra['timestamp'], amostra['metricas'])
+            self.armazenamento.gravar_amostra(nome, amostra)
+        if self.alertas is not None:
+            self.alertas.avaliar(nome, amostra['timestamp'], amostra['metricas'])
+
+    async def coletar_todos(self):
+        # Uma rodada de coleta de todos os dispositivos registrados
+        semaforo = asyncio.Semaphore(self.concorrencia)
+        return await asyncio.gather(*[
+            self.coletar_dispositivo(nome, device, semaforo) for nome, device in list(self.dispositivos.items())
+        ])
+
+    def ultima_amostra(self, nome):
+        with self.lock:
+            return self.amostras.get(nome)
+
+    def estado(self, nome):
+        with self.lock:
+            return self.estados.get(nome)
+
+    def frota(self):
+        # Últimas amostras e estados de todos os dispositivos de uma vez, para a visão da frota
+        with self.lock:
+            return dict(self.amostras), dict(self.estados)
+
+    def alerta_ativo(self, nome, regra):
+        return self.alertas is not None and self.alertas.ativo(nome, regra)
+
+    def registrar_estado(self, nome, estado):
+        with self.lock:
+            self.estados[nome] = estado
+        if self.armazenamento is not None:
+            self.armazenamento.gravar_estado(nome, estado)
+        if self.alertas is not None:
+            self.alertas.avaliar_estado(nome, estado)
+
+    def atualizar_estado(self, nome):
+        # O agente passa a inativo depois de limiteFalhas falhas seguidas e volta a ativo na primeira coleta bem
+        # sucedida; só as mudanças são registradas
+        ativo = self.falhas.get(nome, 0) < limiteFalhas
+        estado = self.estado(nome)
+        if estado is None or estado['ativo'] != ativo:
+            self.registrar_estado(nome, {'ativo': ativo, 'desde': time.time()})
+
+    def serie(self, nome, metrica, ultimos=None):
+        # Cópia (timestamps, valores) da série em memória de uma métrica do dispositivo. A cópia é feita sob o lock
+        # porque a thread do coletor pode compactar o buffer logo depois
+        with self.lock:
+            buffer = self.buffers.get(nome, {}).get(metrica)
+            if buffer is None:
+                return None
+            return buffer.copia(ultimos)
+
+    def marcar_visualizado(self, nome):
+        # Chamado pela interface: o dispositivo passa na frente dos demais quando há coletas acumuladas
+        self.visualizados[nome] = time.time()
+
+    def visualizado(self, nome, agora):
+        return self.visualizados.get(nome, 0) > agora - tempoVisualizado
+
+    def agendar(self, nome, instante):
+        self.proximas_coletas[nome] = instante
+        heapq.heappush(self.agenda, (instante, nome))
+
+    def coletar_agora(self, nome):
+        # Pode ser chamado de outra thread (receptor de traps): a coleta é antecipada dentro do laço do coletor
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.antecipar, nome)
+
+    def antecipar(self, nome):
+        # Um dispositivo que acabou de enviar uma notificação está respondendo: a coleta é completa, sem sondagem.
+        # Se já houver uma coleta em andamento, ela mesma traz os dados novos
+        if nome in self.proximas_coletas:
+            self.falhas.pop(nome, None)
+            self.agendar(nome, time.time())
+
+    def atualizar_agenda(self, agora):
+        # Dispositivos novos começam em uma fase aleatória do seu intervalo; os removidos saem da agenda
+        for nome, device in list(self.dispositivos.items()):
+            if nome not in self.proximas_coletas and nome not in self.em_andamento:
+                self.agendar(nome, agora + random.uniform(0, int(device.get('interval_time') or intervalTime)))
+
+        for nome in set(self.proximas_coletas) - set(self.dispositivos):
+            del self.proximas_coletas[nome]
+            self.falhas.pop(nome, None)
+            if self.alertas is not None:
+                self.alertas.remover(nome)
+
+    def reagendar(self, nome, planejado, sucesso):
+        # Próxima coleta um intervalo depois da planejada, com jitter; a cada falha seguida o intervalo dobra,
+        # até backoffMaximo
+        device = self.dispositivos.get(nome)
+        if device is None:
+            self.proximas_coletas.pop(nome, None)
+            return
+
+        intervalo = int(device.get('interval_time') or intervalTime)
+        if sucesso:
+            self.falhas.pop(nome, None)
+            espera = intervalo
+        elif nome in self.respondendo:
+            # Coleta perdida, mas o agente respondeu à sondagem: não é uma falha do agente
+            espera = intervalo
         else:
-            for var_bind in var_binds_table:
-                results.append(var_bind[1])
+            self.falhas[nome] = self.falhas.get(nome, 0) + 1
+            espera = min(intervalo * 2 ** self.falhas[nome], max(backoffMaximo, intervalo))
+        self.respondendo.discard(nome)
+        self.atualizar_estado(nome)
+
+        espera *= 1 + random.uniform(-jitterColeta, jitterColeta)
+        self.agendar(nome, max(planejado + espera, time.time()))
+
+    async def executar_async(self):
+        self.loop = asyncio.get_running_loop()
+        semaforo = asyncio.Semaphore(self.concorrencia)
+        tarefas = set()
+
+        def concluida(tarefa, nome, planejado):
+            tarefas.discard(tarefa)
+            self.em_andamento.discard(nome)
+            sucesso = not tarefa.cancelled() and tarefa.exception() is None and tarefa.result() is not None
+            # Coleta que terminou depois do horário em que a próxima deveria começar
+            device = self.dispositivos.get(nome)
+            if device is not None and time.time() - planejado > int(device.get('interval_time') or intervalTime):
+                metricas.contar('coleta_estouros_total', dispositivo=nome)
+            self.reagendar(nome, planejado, sucesso)
+
+        proxima_atualizacao = 0
+        while not self.parar.is_set():
+            agora = time.time()
+            if agora >= proxima_atualizacao:
+                self.atualizar_agenda(agora)
+                proxima_atualizacao = agora + 1
+
+            vencidas = []
+            while self.agenda and self.agenda[0][0] <= agora:
+                instante, nome = heapq.heappop(self.agenda)
+                if self.proximas_coletas.get(nome) == instante and nome in self.dispositivos:
+                    vencidas.append((instante, nome))
+
+            # Com mais coletas vencidas do que vagas, os dispositivos visualizados vão primeiro e o restante
+            # volta para a agenda sem perder a vez
+            vencidas.sort(key=lambda item: (not self.visualizado(item[1], agora), item[0]))
+            vagas = max(self.concorrencia - len(self.em_andamento), 0)
+            for instante, nome in vencidas[vagas:]:
+                heapq.heappush(self.agenda, (instante, nome))
+
+            for instante, nome in vencidas[:vagas]:
+                metricas.observar('coleta_atraso_segundos', agora - instante)
+                self.em_andamento.add(nome)
+                del self.proximas_coletas[nome]
+                tarefa = asyncio.create_task(self.coletar_dispositivo(nome, self.dispositivos[nome], semaforo))
+                tarefa.add_done_callback(lambda t, nome=nome, instante=instante: concluida(t, nome, instante))
+                tarefas.add(tarefa)
+
+            pool_sessoes_async.remover_ociosas()
+            if len(vencidas) > vagas:
+                espera = 0.05
+            else:
+                espera = (self.agenda[0][0] if self.agenda else agora + intervalTime) - time.time()
+            await asyncio.sleep(min(max(espera, 0.01), 0.5))
+
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+
+        # Respostas que chegaram antes do fechamento já estão agendadas no laço e não têm mais transporte
+        def ignorar_transporte_fechado(loop, contexto):
+            if not isinstance(contexto.get('exception'), snmp_carrier_erro.CarrierError):
+                loop.default_exception_handler(contexto)
+
+        self.loop.set_exception_handler(ignorar_transporte_fechado)
+        pool_sessoes_async.fechar()
+
+    def executar(self):
+        asyncio.run(self.executar_async())
+
+    def iniciar(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.executar, name='coletor', daemon=True)
+            self.thread.start()
+
+    def finalizar(self):
+        self.parar.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+# ******************************* Coleta em vários processos *******************************
+# A codificação BER do pysnmp é Python puro e disputa o GIL com o servidor web; com muitos dispositivos a coleta
+# é dividida entre processos. Cada processo roda um Coletor sobre a sua fatia dos dispositivos e publica as
+# amostras já com as taxas calculadas em uma fila; o processo web só registra as amostras recebidas.
+class AnelConsistente:
+    # Hashing consistente: cada nó ocupa `replicas` pontos do anel e um dispositivo pertence ao primeiro nó
+    # depois do hash do seu nome, então incluir ou retirar um nó só move os dispositivos daquele nó
+    def __init__(self, nos=(), replicas=100):
+        self.replicas = replicas
+        self.pontos = []
+        self.nos = {}
+        for no in nos:
+            self.adicionar(no)
+
+    @staticmethod
+    def hash(chave):
+        return int.from_bytes(hashlib.md5(str(chave).encode()).digest()[:8], 'big')
+
+    def adicionar(self, no):
+        for replica in range(self.replicas):
+            ponto = self.hash(f'{no}#{replica}')
+            self.nos[ponto] = no
+            bisect.insort(self.pontos, ponto)
+
+    def remover(self, no):
+        self.pontos = [ponto for ponto in self.pontos if self.nos[ponto] != no]
+        self.nos = {ponto: self.nos[ponto] for ponto in self.pontos}
+
+    def no(self, chave):
+        if not self.pontos:
+            return None
+        posicao = bisect.bisect(self.pontos, self.hash(chave)) % len(self.pontos)
+        return self.nos[self.pontos[posicao]]
+
+
+class ColetorFatia(Coletor):
+    # Coletor de um processo de coleta: em vez de guardar as amostras, publica-as para o processo web
+    def __init__(self, dispositivos, fila_amostras, **kwargs):
+        super().__init__(dispositivos, **kwargs)
+        self.fila_amostras = fila_amostras
+
+    def registrar(self, nome, amostra):
+        self.fila_amostras.put(('amostra', nome, amostra))
+
+    def registrar_estado(self, nome, estado):
+        with self.lock:
+            self.estados[nome] = estado
+        self.fila_amostras.put(('estado', nome, estado))
+
+
+def processo_coletor(identificador, fila_amostras, fila_fatias, concorrencia, timeout):
+    # Ponto de entrada de cada processo de coleta. Avisa que está pronto com ('pronto', identificador) e recebe pela
+    # fila ('fatia', dispositivos), trocada inteira sempre que o processo web redistribui, ('visualizados', ...)
+    # com os dispositivos abertos na interface e ('coletar', nome) para antecipar uma coleta; None encerra.
+    # A cada poucos segundos envia ('metricas', identificador, estado) com a instrumentação do processo
+    coletor_fatia = ColetorFatia({}, fila_amostras, concorrencia=concorrencia, timeout=timeout)
+    coletor_fatia.iniciar()
+    fila_amostras.put(('pronto', identificador, None))
+
+    while True:
+        try:
+            mensagem = fila_fatias.get(timeout=5)
+        except queue.Empty:
+            fila_amostras.put(('metricas', identificador, metricas.estado()))
+            continue
+        if mensagem is None:
+            break
+        tipo, dados = mensagem
+        if tipo == 'visualizados':
+            coletor_fatia.visualizados = dados
+            continue
+        if tipo == 'coletar':
+            coletor_fatia.coletar_agora(dados)
+            continue
+        for nome in set(coletor_fatia.dispositivos) - set(dados):
+            coletor_fatia.motor_taxas.remover(nome)
+        coletor_fatia.dispositivos = dados
+
+    coletor_fatia.finalizar()
+
+
+class ColetorDistribuido(Coletor):
+    # Mesma interface de leitura do Coletor (ultima_amostra, serie), mas a coleta roda em `processos` processos.
+    # Uma thread supervisora recebe as amostras, redistribui os dispositivos quando o inventário muda e substitui
+    # processos que morreram. Um processo só entra no anel depois de avisar que está pronto, então enquanto o
+    # substituto sobe os dispositivos do processo morto ficam com os demais
+    def __init__(self, dispositivos, processos, **kwargs):
+        super().__init__(dispositivos, **kwargs)
+        self.processos = processos
+        self.contexto = multiprocessing.get_context('spawn')
+        self.fila_amostras = self.contexto.Queue()
+        self.anel = AnelConsistente()
+        self.trabalhadores = {}
+        self.fatias = {}
+        self.visualizados_enviados = {}
+        # Última instrumentação recebida de cada processo, exportada junto com a do processo web
+        self.metricas_processos = {}
+        self.proximo_id = 0
+
+    def adicionar_processo(self):
+        fila_fatias = self.contexto.Queue()
+        processo = self.contexto.Process(
+            target=processo_coletor,
+            args=(self.proximo_id, self.fila_amostras, fila_fatias, self.concorrencia, self.timeout),
+            name=f'coletor-{self.proximo_id}', daemon=True
+        )
+        processo.start()
+        self.trabalhadores[self.proximo_id] = (processo, fila_fatias)
+        self.proximo_id += 1
+
+    def remover_processo(self, identificador):
+        processo, fila_fatias = self.trabalhadores.pop(identificador)
+        self.metricas_processos.pop(identificador, None)
+        if identificador in self.fatias:
+            self.anel.remover(identificador)
+            del self.fatias[identificador]
+        if processo.is_alive():
+            fila_fatias.put(None)
+        self.redistribuir()
+
+    def redistribuir(self):
+        # Envia a cada processo pronto a sua fatia, apenas quando ela mudou
+        if not self.fatias:
+            return
+
+        fatias = {identificador: {} for identificador in self.fatias}
+        for nome, device in list(self.dispositivos.items()):
+            fatias[self.anel.no(nome)][nome] = device
+
+        for identificador, fatia in fatias.items():
+            fatia = {nome: dict(device) for nome, device in fatia.items()}
+            if self.fatias.get(identificador) != fatia:
+                self.fatias[identificador] = fatia
+                self.trabalhadores[identificador][1].put(('fatia', fatia))
+
+    def coletar_agora(self, nome):
+        identificador = self.anel.no(nome)
+        if identificador in self.fatias:
+            self.trabalhadores[identificador][1].put(('coletar', nome))
+
+    def supervisionar(self):
+        for identificador, (processo, _) in list(self.trabalhadores.items()):
+            if not processo.is_alive():
+                print(f'Processo de coleta {processo.name} terminou (código {processo.exitcode}), substituindo')
+                self.remover_processo(identificador)
+                self.adicionar_processo()
+        self.redistribuir()
+
+        # As prioridades da interface valem para todos os processos
+        if self.visualizados != self.visualizados_enviados:
+            self.visualizados_enviados = dict(self.visualizados)
+            for identificador in self.fatias:
+                self.trabalhadores[identificador][1].put(('visualizados', self.visualizados_enviados))
+
+    def executar(self):
+        for _ in range(self.processos):
+            self.adicionar_processo()
+
+        proxima_supervisao = 0
+        while not self.parar.is_set():
+            try:
+                tipo, nome, dados = self.fila_amostras.get(timeout=0.5)
+            except queue.Empty:
+                pass
+            else:
+                if tipo == 'pronto':
+                    # Processo pronto: entra no anel e recebe a sua fatia
+                    self.anel.adicionar(nome)
+                    self.fatias[nome] = None
+                    self.visualizados_enviados = {}
+                    self.redistribuir()
+                elif tipo == 'metricas':
+                    self.metricas_processos[nome] = dados
+                elif nome in self.dispositivos:
+                    if tipo == 'amostra':
+                        self.registrar(nome, dados)
+                    else:
+                        self.registrar_estado(nome, dados)
+
+            if time.time() >= proxima_supervisao:
+                self.supervisionar()
+                proxima_supervisao = time.time() + 1
+
+        for identificador in list(self.trabalhadores):
+            processo, fila_fatias = self.trabalhadores.pop(identificador)
+            fila_fatias.put(None)
+            processo.join(timeout=self.timeout)
+            if processo.is_alive():
+                processo.terminate()
+
+
+# ******************************* Traps *******************************
+oidSnmpTrap = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1, 0)
+oidSnmpTrapAddress = (1, 3, 6, 1, 6, 3, 18, 1, 3, 0)
+oidIfEntry = (1, 3, 6, 1, 2, 1, 2, 2, 1)
+
+# Notificações genéricas (SNMPv2-MIB e IF-MIB); as demais são gravadas com o OID
+tiposTrap = {
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 1): 'coldStart',
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 2): 'warmStart',
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 3): 'linkDown',
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 4): 'linkUp',
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 5): 'authenticationFailure',
+}
 
-    return results
+
+class ReceptorTraps:
+    # Recebe traps e informs SNMPv1/v2c (os informs são confirmados pelo próprio pysnmp) em um laço asyncio
+    # próprio, numa thread de fundo. As notificações são acumuladas e tratadas em lotes a cada `intervalo_lote`
+    # segundos: o lote inteiro é gravado de uma vez no banco e cada dispositivo afetado recebe uma única coleta
+    # antecipada, por mais notificações que tenha enviado no período
+    def __init__(self, dispositivos, coletor, armazenamento=None, porta=trapPort, endereco='0.0.0.0',
+                 intervalo_lote=0.5):
+        self.dispositivos = dispositivos
+        self.coletor = coletor
+        self.armazenamento = armazenamento
+        self.porta = porta
+        self.endereco = endereco
+        self.intervalo_lote = intervalo_lote
+        self.lote = []
+        self.comunidades = set()
+        self.resolvidos = {}
+        self.parar = threading.Event()
+        self.thread = None
+
+    def ao_receber(self, snmp_engine, state_reference, context_engine_id, context_name, var_binds, cb_ctx):
+        _, origem = snmp_engine.msgAndPduDsp.getTransportInfo(state_reference)
+        self.lote.append((time.time(), origem[0], [(tuple(oid), valor) for oid, valor in var_binds]))
+
+    def enderecos(self):
+        # IP -> nome do dispositivo; os endereços configurados como nomes são resolvidos uma única vez
+        por_ip = {}
+        for nome, device in list(self.dispositivos.items()):
+            if device['ip'] not in self.resolvidos:
+                try:
+                    self.resolvidos[device['ip']] = socket.gethostbyname(device['ip'])
+                except OSError:
+                    self.resolvidos[device['ip']] = device['ip']
+            por_ip[self.resolvidos[device['ip']]] = nome
+        return por_ip
+
+    def processar(self, lote):
+        por_ip = self.enderecos()
+        eventos = []
+        afetados = set()
+
+        for timestamp, origem, var_binds in lote:
+            valores = dict(var_binds)
+            # Traps SNMPv1 convertidos e traps repassados por proxies trazem o agente de origem no snmpTrapAddress
+            nome = por_ip.get(origem) or por_ip.get(str(valores.get(oidSnmpTrapAddress, '')))
+            oid_trap = tuple(valores.get(oidSnmpTrap, ()))
+            tipo = tiposTrap.get(oid_trap) or '.'.join(map(str, oid_trap))
+            # linkUp/linkDown identificam a interface pelo índice dos objetos da ifEntry (ifIndex, ifOperStatus...)
+            interface = next((oid[-1] for oid, _ in var_binds if oid[:len(oidIfEntry)] == oidIfEntry), 0)
+
+            eventos.append((nome or origem, timestamp, tipo, interface))
+            if nome is not None:
+                afetados.add(nome)
+
+        if self.armazenamento is not None:
+            self.armazenamento.gravar_eventos(eventos)
+        for nome in afetados:
+            self.coletor.coletar_agora(nome)
+
+    def configurar_comunidades(self, snmp_engine):
+        # Traps SNMPv3 exigiriam os usuários de cada agente na engine do receptor; só v1/v2c são aceitos
+        # Comunidade vazia ou inválida fica de fora sem derrubar a recepção dos demais dispositivos
+        for device in list(self.dispositivos.values()):
+            comunidade = device.get('community')
+            if not comunidade or comunidade in self.comunidades:
+                continue
+            self.comunidades.add(comunidade)
+            try:
+                snmp_config.addV1System(snmp_engine, comunidade, comunidade)
+            except Exception as e:
+                print(f'Comunidade {comunidade!r} não registrada no receptor de traps: {e}')
+
+    async def executar_async(self):
+        snmp_engine = hlapi.SnmpEngine()
+        try:
+            transporte = snmp_udp.UdpAsyncioTransport().openServerMode((self.endereco, self.porta))
+        except Exception as e:
+            print(f'Receptor de traps desativado: não foi possível usar a porta {self.porta} ({e})')
+            return
+
+        snmp_config.addTransport(snmp_engine, snmp_udp.domainName, transporte)
+        self.configurar_comunidades(snmp_engine)
+        snmp_ntfrcv.NotificationReceiver(snmp_engine, self.ao_receber)
+
+        while not self.parar.is_set():
+            await asyncio.sleep(self.intervalo_lote)
+            self.configurar_comunidades(snmp_engine)
+            lote, self.lote = self.lote, []
+            if lote:
+                self.processar(lote)
+
+        snmp_engine.transportDispatcher.closeDispatcher()
+
+    def executar(self):
+        asyncio.run(self.executar_async())
+
+    def iniciar(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.executar, name='traps', daemon=True)
+            self.thread.start()
+
+    def finalizar(self):
+        self.parar.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+# ******************************* Alertas *******************************
+class RegraLimiar:
+    # Dispara quando o valor passa de `limite` (acima=True) ou fica abaixo dele (acima=False) por `amostras`
+    # amostras seguidas, e só se resolve quando volta para o outro lado de `limpeza`. A faixa entre os dois é a
+    # histerese, que evita alertas oscilando com um valor perto do limite
+    def __init__(self, nome, metrica, limite, limpeza=None, acima=True, amostras=1, severidade='aviso'):
+        self.nome = nome
+        self.metrica = metrica
+        self.limite = limite
+        self.limpeza = limite if limpeza is None else limpeza
+        self.acima = acima
+        self.amostras = amostras
+        self.severidade = severidade
+
+    def valor(self, estado, timestamp, valor):
+        # Valor comparado com o limite; as subclasses derivam outro valor guardando o que precisam em `estado`
+        return valor
+
+    def violacao(self, valor, ativo):
+        # True se viola, False se está normal; dentro da histerese mantém a situação atual
+        if self.acima:
+            return valor > self.limite if not ativo else valor > self.limpeza
+        return valor < self.limite if not ativo else valor < self.limpeza
+
+
+class RegraVariacao(RegraLimiar):
+    # Limiar aplicado à variação por segundo da métrica entre duas amostras seguidas
+    def valor(self, estado, timestamp, valor):
+        anterior = estado.get('anterior')
+        estado['anterior'] = (timestamp, valor)
+        if anterior is None or timestamp <= anterior[0]:
+            return None
+        return (valor - anterior[1]) / (timestamp - anterior[0])
+
+
+class RegraAnomalia(RegraLimiar):
+    # Limiar aplicado ao z-score da amostra em relação à média e variância móveis exponenciais (EWMA) da
+    # própria métrica. As primeiras `aquecimento` amostras só alimentam a média, e o desvio considerado é de pelo
+    # menos `variacao_minima` da média, para que uma série quase constante não dispare com qualquer oscilação
+    def __init__(self, nome, metrica, limite=4, limpeza=2, alfa=0.05, aquecimento=20, variacao_minima=0.05,
+                 **kwargs):
+        super().__init__(nome, metrica, limite, limpeza, **kwargs)
+        self.alfa = alfa
+        self.aquecimento = aquecimento
+        self.variacao_minima = variacao_minima
+
+    def valor(self, estado, timestamp, valor):
+        n = estado.get('n', 0)
+        if n == 0:
+            estado.update(n=1, media=valor, variancia=0.0)
+            return None
+
+        diferenca = valor - estado['media']
+        desvio = max(estado['variancia'] ** 0.5, self.variacao_minima * abs(estado['media']))
+        z = abs(diferenca) / desvio if desvio > 0 else (0.0 if diferenca == 0 else float('inf'))
+
+        estado['n'] = n + 1
+        estado['media'] += self.alfa * diferenca
+        estado['variancia'] = (1 - self.alfa) * (estado['variancia'] + self.alfa * diferenca * diferenca)
+
+        return z if n >= self.aquecimento else None
+
+
+class DestinoLog:
+    def enviar(self, alerta):
+        print(f"[{alerta['severidade']}] {alerta['dispositivo']}: {alerta['mensagem']}")
+
+
+class DestinoArquivo:
+    # Um alerta por linha, em JSON
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.lock = threading.Lock()
+
+    def enviar(self, alerta):
+        with self.lock, open(self.caminho, 'a', encoding='utf-8') as arquivo:
+            arquivo.write(json.dumps(alerta, ensure_ascii=False) + '\n')
+
+
+class DestinoWebhook:
+    # POST do alerta em JSON numa thread própria, para que um servidor lento não atrase a coleta
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.fila = queue.Queue(maxsize=1000)
+        self.thread = None
+
+    def enviar(self, alerta):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.executar, name='webhook-alertas', daemon=True)
+            self.thread.start()
+        try:
+            self.fila.put_nowait(alerta)
+        except queue.Full:
+            print(f'Fila do webhook de alertas cheia, alerta descartado: {alerta["mensagem"]}')
+
+    def executar(self):
+        import urllib.request
+
+        while True:
+            alerta = self.fila.get()
+            pedido = urllib.request.Request(self.url, data=json.dumps(alerta).encode(),
+                                            headers={'Content-Type': 'application/json'})
+            try:
+                urllib.request.urlopen(pedido, timeout=self.timeout).close()
+            except Exception as e:
+                print(f'Falha no envio do alerta para {self.url}: {e}')
+
+
+class DestinoEventos:
+    # Grava os alertas na tabela de eventos do banco, junto com os traps
+    def __init__(self, armazenamento):
+        self.armazenamento = armazenamento
+
+    def enviar(self, alerta):
+        self.armazenamento.gravar_eventos([(alerta['dispositivo'], alerta['timestamp'],
+                                            f"{alerta['regra']}:{alerta['situacao']}", alerta['interface'])])
+
+
+class MotorAlertas:
+    # Avalia as regras a cada amostra que chega, com custo constante por ponto: as regras ficam indexadas pela
+    # métrica e cada (regra, dispositivo, interface) guarda apenas um pequeno estado, sem reler o histórico.
+    # Só as transições são enviadas aos destinos: um alerta disparado não se repete enquanto continuar ativo
+    def __init__(self, regras, destinos):
+        self.regras = {}
+        for regra in regras:
+            self.regras.setdefault(regra.metrica, []).append(regra)
+        self.destinos = destinos
+        self.estados = {}
+        self.ativos = {}
+        self.lock = threading.Lock()
+
+    def avaliar(self, nome, timestamp, pontos):
+        # pontos: [(metrica, interface, valor), ...] como em metricas_amostra
+        alertas = []
+        with self.lock:
+            for metrica, interface, valor in pontos:
+                for regra in self.regras.get(metrica, ()):
+                    chave = (regra.nome, nome, interface)
+                    estado = self.estados.get(chave)
+                    if estado is None:
+                        estado = self.estados[chave] = {'consecutivas': 0}
+
+                    derivado = regra.valor(estado, timestamp, valor)
+                    if derivado is None:
+                        continue
+
+                    ativo = chave in self.ativos
+                    if regra.violacao(derivado, ativo):
+                        estado['consecutivas'] += 1
+                        if not ativo and estado['consecutivas'] >= regra.amostras:
+                            alertas.append(self.transicao(regra, nome, interface, timestamp, valor, 'disparado'))
+                    else:
+                        estado['consecutivas'] = 0
+                        if ativo:
+                            alertas.append(self.transicao(regra, nome, interface, timestamp, valor, 'resolvido'))
+
+        self.enviar(alertas)
+
+    def avaliar_estado(self, nome, estado):
+        # Agente inativo, a partir das mudanças de estado do coletor, que já chegam sem repetição
+        regra = regraAgenteInativo
+        chave = (regra.nome, nome, 0)
+        with self.lock:
+            if estado['ativo'] == (chave not in self.ativos):
+                return
+            alerta = self.transicao(regra, nome, 0, estado['desde'], None,
+                                    'resolvido' if estado['ativo'] else 'disparado')
+        self.enviar([alerta])
+
+    def transicao(self, regra, nome, interface, timestamp, valor, situacao):
+        chave = (regra.nome, nome, interface)
+        if situacao == 'disparado':
+            self.ativos[chave] = timestamp
+        else:
+            del self.ativos[chave]
+
+        alvo = f'interface {interface}' if interface else 'dispositivo'
+        return {
+            'regra': regra.nome,
+            'severidade': regra.severidade,
+            'situacao': situacao,
+            'dispositivo': nome,
+            'interface': interface,
+            'metrica': regra.metrica,
+            'valor': valor,
+            'timestamp': timestamp,
+            'mensagem': f'{regra.nome} {situacao} ({alvo}, {regra.metrica} = {valor})'
+        }
+
+    def enviar(self, alertas):
+        for alerta in alertas:
+            metricas.contar('alertas_total', regra=alerta['regra'], situacao=alerta['situacao'])
+            for destino in self.destinos:
+                try:
+                    destino.enviar(alerta)
+                except Exception as e:
+                    print(f'Falha no destino de alertas {type(destino).__name__}: {e}')
+
+    def ativo(self, nome, regra, interface=0):
+        return (regra, nome, interface) in self.ativos
+
+    def alertas_ativos(self, nome=None):
+        with self.lock:
+            return [(regra, dispositivo, interface, desde) for (regra, dispositivo, interface), desde
+                    in self.ativos.items() if nome is None or dispositivo == nome]
+
+    def remover(self, nome):
+        with self.lock:
+            for chave in [chave for chave in self.estados if chave[1] == nome]:
+                del self.estados[chave]
+            for chave in [chave for chave in self.ativos if chave[1] == nome]:
+                del self.ativos[chave]
+
+
+# Regra usada pelo MotorAlertas.avaliar_estado; o agente é dado como inativo pelo coletor depois de limiteFalhas
+# coletas seguidas sem resposta
+regraAgenteInativo = RegraLimiar('agenteInativo', 'ativo', 0.5, acima=False, severidade='critico')
+
+# Utilização e erros em fração (0 a 1), datagramas com erro em porcentagem, tempo ativo em segundos
+regras_alerta = [
+    RegraLimiar('agenteReiniciado', 'tempoAtivo', 60, acima=False, severidade='critico'),
+    RegraLimiar('utilizacaoAlta', 'utilizacaoLink', 0.9, limpeza=0.8, amostras=3),
+    RegraLimiar('interfaceSaturada', 'ifUtilizacao', 0.95, limpeza=0.85, amostras=3),
+    RegraLimiar('pacotesComErro', 'porcentagemPacotesErro', 0.01, limpeza=0.005, amostras=2),
+    RegraLimiar('datagramasComErro', 'porcentagemDatagramasErro', 1, limpeza=0.5, amostras=2),
+    RegraVariacao('errosIpSubindo', 'porcentagemDatagramasErro', 0.1, limpeza=0, amostras=2),
+    RegraAnomalia('forwardingAnomalo', 'taxaForwarding'),
+    RegraAnomalia('trafegoAnomalo', 'taxaBytes'),
+]
+
+
+def destinos_alerta(armazenamento):
+    destinos = [DestinoLog(), DestinoEventos(armazenamento)]
+    if arquivoAlertas:
+        destinos.append(DestinoArquivo(arquivoAlertas))
+    if webhookAlertas:
+        destinos.append(DestinoWebhook(webhookAlertas))
+    return destinos
+
+
+# ******************************* Cadastro em lote e descoberta *******************************
+# Campos aceitos na importação, além de 'nome' (padrão: o IP); os demais são ignorados
+camposDispositivo = ['ip', 'port', 'community', 'version', 'interval_time', 'timeout', 'retries', 'max_msg_size',
+                     'user', 'auth_protocol', 'auth_key', 'priv_protocol', 'priv_key']
+camposInteiros = ['port', 'interval_time', 'retries', 'max_msg_size']
+
+
+def normalizar_dispositivo(registro):
+    # Registro de CSV/YAML -> (nome, device) no formato de `devices`, sem os campos vazios
+    device = {campo: registro[campo] for campo in camposDispositivo if registro.get(campo) not in (None, '')}
+    if 'ip' not in device:
+        raise ValueError(f'dispositivo sem ip: {registro}')
+
+    for campo in camposInteiros:
+        if campo in device:
+            device[campo] = int(device[campo])
+    if 'timeout' in device:
+        device['timeout'] = float(device['timeout'])
+    device['ip'] = str(device['ip'])
+    device.setdefault('version', 'v2c')
+    device.setdefault('interval_time', intervalTime)
+
+    if device['version'] not in snmpVersions:
+        raise ValueError(f"versão SNMP desconhecida para {device['ip']}: {device['version']}")
+    if device['version'] == 'v3':
+        if 'user' not in device:
+            raise ValueError(f"dispositivo SNMPv3 sem usuário: {device['ip']}")
+        if device.get('auth_protocol', 'none') not in protocolosAutenticacao:
+            raise ValueError(f"protocolo de autenticação desconhecido para {device['ip']}")
+        if device.get('priv_protocol', 'none') not in protocolosPrivacidade:
+            raise ValueError(f"protocolo de privacidade desconhecido para {device['ip']}")
+    else:
+        device.setdefault('community', 'public')
+
+    return str(registro.get('nome') or device['ip']), device
+
+
+def ler_dispositivos(caminho):
+    # CSV com cabeçalho, ou YAML com uma lista de dispositivos ou um mapa nome -> dispositivo
+    if caminho.lower().endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError('A importação de YAML precisa do PyYAML (pip install pyyaml); use CSV ou instale-o')
+        with open(caminho, encoding='utf-8') as arquivo:
+            dados = yaml.safe_load(arquivo) or []
+        if isinstance(dados, dict):
+            dados = [dict(device, nome=device.get('nome', nome)) for nome, device in dados.items()]
+    else:
+        with open(caminho, newline='', encoding='utf-8') as arquivo:
+            dados = list(csv.DictReader(arquivo))
+
+    return dict(normalizar_dispositivo(registro) for registro in dados)
+
+
+def importar_dispositivos(caminho):
+    # Valida o arquivo inteiro antes de gravar: um registro inválido não deixa a importação pela metade
+    dispositivos = ler_dispositivos(caminho)
+    armazenamento.registrar_dispositivos(dispositivos)
+    devices.update(dispositivos)
+    print(f'{len(dispositivos)} dispositivo(s) importado(s) de {caminho}')
+    return dispositivos
+
+
+class LimiteTaxa:
+    # Balde de fichas: no máximo `taxa` requisições por segundo, com rajadas de até `rajada`
+    def __init__(self, taxa, rajada=None):
+        self.taxa = taxa
+        self.rajada = rajada or max(1, taxa / 10)
+        self.fichas = self.rajada
+        self.ultimo = time.monotonic()
+
+    async def aguardar(self):
+        while True:
+            agora = time.monotonic()
+            self.fichas = min(self.rajada, self.fichas + (agora - self.ultimo) * self.taxa)
+            self.ultimo = agora
+            if self.fichas >= 1:
+                self.fichas -= 1
+                return
+            await asyncio.sleep((1 - self.fichas) / self.taxa)
+
+
+async def sondar_agente(device, limite):
+    # GET de sysObjectID e sysName sem retransmissões; hosts sem agente são esperados e não geram mensagens
+    await limite.aguardar()
+    engine, auth, transport = pool_sessoes_async.sessao(device)
+    inicio = time.time()
+    error_indication, error_status, _, var_binds = await snmp_asyncio.getCmd(
+        engine, auth, transport, hlapi.ContextData(),
+        hlapi.ObjectType(hlapi.ObjectIdentity(oids['sysObjectID'])),
+        hlapi.ObjectType(hlapi.ObjectIdentity(oids['sysName'])),
+        lookupMib=False
+    )
+    medir_requisicao(device, 'get', inicio, error_indication, error_status, var_binds)
+    if error_indication or error_status:
+        return None
+    return {'sysObjectID': str(var_binds[0][1]), 'sysName': str(var_binds[1][1])}
+
+
+async def descobrir_async(rede, modelos, concorrencia, taxa, timeout):
+    # Sonda todos os hosts da rede com cada modelo de credenciais, na ordem, até um deles responder
+    limite = LimiteTaxa(taxa)
+    semaforo = asyncio.Semaphore(concorrencia)
+    encontrados = {}
+
+    async def sondar(ip):
+        async with semaforo:
+            for modelo in modelos:
+                device = dict(modelo, ip=ip)
+                resposta = await sondar_agente(dict(device, timeout=timeout, retries=0), limite)
+                if resposta is not None:
+                    encontrados[ip] = device
+                    print(f"{ip}: {resposta['sysName'] or '-'} ({resposta['sysObjectID']})")
+                    return
+
+    try:
+        await asyncio.gather(*[sondar(str(ip)) for ip in ipaddress.ip_network(rede, strict=False).hosts()])
+    finally:
+        pool_sessoes_async.fechar()
+    return encontrados
+
+
+def descobrir(rede, modelos, concorrencia=256, taxa=200, timeout=1):
+    # Varredura de uma faixa CIDR com sondas concorrentes sob limite de taxa; os agentes encontrados entram no
+    # inventário persistido, com o IP como nome. Com as 200 sondas/s padrão uma /22 leva cerca de 5 s
+    inicio = time.time()
+    encontrados = asyncio.run(descobrir_async(rede, modelos, concorrencia, taxa, timeout))
+    armazenamento.registrar_dispositivos(encontrados)
+    devices.update(encontrados)
+    print(f'{len(encontrados)} agente(s) encontrado(s) em {rede} em {time.time() - inicio:.1f} s')
+    return encontrados
+
+
+# ******************************* Visualização *******************************
+class ColetorLeitura:
+    # Substitui o coletor na interface quando a coleta roda em outro processo (python main.py collect): as
+    # amostras e as séries vêm do banco de séries temporais e nenhuma requisição SNMP é feita
+    def __init__(self, dispositivos, armazenamento, validade_frota=1):
+        self.dispositivos = dispositivos
+        self.armazenamento = armazenamento
+        self.amostras = {}
+        # Leitura da frota compartilhada pelas abas abertas neste processo por `validade_frota` segundos
+        self.validade_frota = validade_frota
+        self.frota_lida = (0, None)
+        self.lock_frota = threading.Lock()
+        self.parar = threading.Event()
+        self.thread = None
+
+    def ultima_amostra(self, nome):
+        timestamp, amostra = self.amostras.get(nome, (0, None))
+        linha = self.armazenamento.ultima_amostra(nome, timestamp)
+        if linha is not None and linha[1] is not None:
+            self.amostras[nome] = linha
+            amostra = linha[1]
+        return amostra
+
+    def marcar_visualizado(self, nome):
+        # A coleta roda em outro processo, que agenda os dispositivos sem prioridade
+        pass
+
+    def estado(self, nome):
+        return self.armazenamento.estado(nome)
+
+    def frota(self):
+        # Uma consulta para as últimas amostras e outra para os estados de todos os dispositivos, por mais
+        # dispositivos e abas que existam; só as amostras novas são decodificadas
+        with self.lock_frota:
+            if time.time() - self.frota_lida[0] < self.validade_frota:
+                return self.frota_lida[1]
+            desde = {nome: timestamp for nome, (timestamp, _) in list(self.amostras.items())}
+            for nome, linha in self.armazenamento.ultimas_amostras(desde).items():
+                if linha[1] is not None:
+                    self.amostras[nome] = linha
+            resultado = ({nome: amostra for nome, (_, amostra) in list(self.amostras.items())},
+                         self.armazenamento.estados())
+            self.frota_lida = (time.time(), resultado)
+            return resultado
+
+    def alerta_ativo(self, nome, regra):
+        # Os alertas são avaliados no processo de coleta e chegam aqui pela tabela de eventos (DestinoEventos)
+        return self.armazenamento.ultimo_evento(nome, [f'{regra}:disparado', f'{regra}:resolvido']) == \
+            f'{regra}:disparado'
+
+    def serie(self, nome, metrica, ultimos=None):
+        timestamps, valores = self.armazenamento.ultimos_pontos(nome, metrica, ultimos or capacidadeBuffer)
+        return (timestamps, valores) if timestamps else None
+
+    def executar(self):
+        # Acompanha os dispositivos cadastrados por outros processos
+        while not self.parar.wait(5):
+            sincronizar_dispositivos()
+
+    def iniciar(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.executar, name='visualizacao', daemon=True)
+            self.thread.start()
+
+    def finalizar(self):
+        self.parar.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def sincronizar_dispositivos():
+    # Inclui em `devices` os dispositivos cadastrados no banco pela interface ou por outro processo
+    for nome, device in armazenamento.dispositivos().items():
+        if devices.get(nome) != device:
+            devices[nome] = device
+
+
+def acompanhar_dispositivos(intervalo=5):
+    while True:
+        time.sleep(intervalo)
+        sincronizar_dispositivos()
+
+
+def executar_coletor():
+    # Coleta contínua sem interface, até receber SIGINT ou SIGTERM. As amostras ficam no banco de séries
+    # temporais, de onde a interface (python main.py view) as lê
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+
+    sincronizar_dispositivos()
+    armazenamento.iniciar()
+    coletor.iniciar()
+    receptor.iniciar()
+    try:
+        while not parar.wait(5):
+            sincronizar_dispositivos()
+    except KeyboardInterrupt:
+        pass
+
+    receptor.finalizar()
+    coletor.finalizar()
+    armazenamento.finalizar()
+
+
+armazenamento = ArmazenamentoSeries(seriesDatabase)
+motor_alertas = MotorAlertas(regras_alerta, destinos_alerta(armazenamento))
+if processosColetor:
+    coletor = ColetorDistribuido(devices, processosColetor, armazenamento=armazenamento, alertas=motor_alertas)
+else:
+    coletor = Coletor(devices, armazenamento=armazenamento, alertas=motor_alertas)
+receptor = ReceptorTraps(devices, coletor, armazenamento)
+
+
+def criar_servidor():
+    # Ponto de entrada WSGI para servir a interface em vários workers (gunicorn 'main:criar_servidor()'). Cada
+    # worker apenas lê o banco gravado por `python main.py collect`, e a seleção de dispositivo vem de cada aba,
+    # então o número de workers e de abas abertas não altera a carga SNMP
+    global coletor
+    sincronizar_dispositivos()
+    coletor = ColetorLeitura(devices, armazenamento)
+    coletor.iniciar()
+    return app.server
+
+
+def amostra_atual(nome):
+    # Última amostra do dispositivo, sem fazer nenhuma requisição. O dispositivo aberto na interface tem
+    # prioridade no agendamento da coleta
+    if nome not in devices:
+        raise PreventUpdate
+    coletor.marcar_visualizado(nome)
+    amostra = coletor.ultima_amostra(nome)
+    if amostra is None:
+        raise PreventUpdate
+    return amostra
 
 
 # Estrutura básica
@@ -165,6 +2618,12 @@ final_html = html.Div(
             n_intervals=0
         ),
 
+        # Último timestamp de cada métrica já enviado ao navegador
+        dcc.Store(id='graficos-ultimo'),
+
+        # Dispositivo exibido nesta aba; todos os callbacks recebem a seleção daqui
+        dcc.Store(id='dispositivo-selecionado', storage_type='session'),
+
         html.H1('Simple Network Management Protocol - Monitores de Recurso e Desempenho',
                 style={'width': '100%', 'justify-content': 'center', 'text-align': 'center'}),
 
@@ -180,18 +2639,42 @@ final_html = html.Div(
             html.Label("Periodicidade (s):"),
             dcc.Input(id='device-interfaces', type='number'),
 
+            html.Label("Versão:"),
+            dcc.Dropdown(id='device-version', options=list(snmpVersions), value='v2c', clearable=False,
+                         style={'width': '80px'}),
+
             html.Button("Confirmar", id='confirm-button', n_clicks=0),
 
             html.Div(id='confirmation-message')
 
         ], style={'display': 'flex', 'width': '100%', 'justify-content': 'space-between', 'align-items': 'center'}),
 
+        # Credenciais do USM, usadas apenas quando a versão é v3 (a comunidade é ignorada)
+        html.Div([
+            html.Label("Usuário (v3):"),
+            dcc.Input(id='device-user', type='text'),
+
+            html.Label("Autenticação:"),
+            dcc.Dropdown(id='device-auth-protocol', options=list(protocolosAutenticacao), value='sha',
+                         clearable=False, style={'width': '100px'}),
+            dcc.Input(id='device-auth-key', type='password'),
+
+            html.Label("Privacidade:"),
+            dcc.Dropdown(id='device-priv-protocol', options=list(protocolosPrivacidade), value='aes',
+                         clearable=False, style={'width': '100px'}),
+            dcc.Input(id='device-priv-key', type='password')
+
+        ], style={'display': 'flex', 'width': '100%', 'justify-content': 'space-between', 'align-items': 'center'}),
+
         html.Div([
             html.H2("Selecione um Dispositivo:"),
             dcc.Dropdown(
                 id='device-dropdown',
                 options=[{'label': device, 'value': device} for device in devices.keys()],
-                value='localhost',  # Define o valor inicial para localhost
+                value=dispositivoPadrao,
+                # A aba recarregada volta para o dispositivo que estava aberto nela
+                persistence=True,
+                persistence_type='session',
                 style={'width': '50%'}
             ),
             html.Div(id='selected-device-info')  # Para exibir as informações do dispositivo selecionado
@@ -202,34 +2685,73 @@ final_html = html.Div(
             html.Div([
                 html.H2('Informações', style={'width': '100%', 'justify-content': 'center', 'text-align': 'center',
                                               'border': 'solid 2px black'}),
-                html.Div(id='my-output')
+                html.Div(id='my-output-status'),
+                html.Div(id='my-output'),
+                # Dispositivo e versão do inventário do painel estático exibido nesta aba
+                dcc.Store(id='painel-versao')
             ], style={'display': 'flex', 'flex-direction': 'column', 'width': '100%'}),
 
             html.H2('Desempenho', style={'width': '100%', 'justify-content': 'center', 'text-align': 'center',
                                          'border': 'solid 2px black'}),
             html.Div([
-                dcc.Graph(style={'width': '50%', 'height': '50%'}, id='graph1', animate=True),
-                dcc.Graph(style={'width': '50%', 'height': '50%'}, id='graph2', animate=True)
+                html.Label("Período:"),
+                dcc.Dropdown(
+                    id='periodo-dropdown',
+                    options=[{'label': 'Tempo real', 'value': 0},
+                             {'label': 'Última hora', 'value': 3600},
+                             {'label': 'Último dia', 'value': 86400},
+                             {'label': 'Última semana', 'value': 604800}],
+                    value=0,
+                    clearable=False,
+                    style={'width': '50%'}
+                )
+            ], style={'display': 'flex', 'width': '100%', 'align-items': 'center'}),
+            html.Div([
+                dcc.Graph(style={'width': '50%', 'height': '50%'}, id='graph1'),
+                dcc.Graph(style={'width': '50%', 'height': '50%'}, id='graph2')
             ], style={'display': 'flex',
                       'flex-direction': 'row',
                       'width': '100%',
                       }),
 
             html.Div([
-                dcc.Graph(style={'width': '50%', 'height': '50%'}, id='graph3', animate=True),
-                dcc.Graph(style={'width': '50%', 'height': '50%'}, id='graph4', animate=True)
+                dcc.Graph(style={'width': '50%', 'height': '50%'}, id='graph3'),
+                dcc.Graph(style={'width': '50%', 'height': '50%'}, id='graph4')
             ], style={'display': 'flex',
                       'flex-direction': 'row',
                       'width': '100%',
                       }),
 
             html.Div([
-                dcc.Graph(style={'width': '50%', 'height': '50%'}, id='graph5', animate=True),
-                dcc.Graph(style={'width': '50%', 'height': '50%'}, id='graph6', animate=True)
+                dcc.Graph(style={'width': '50%', 'height': '50%'}, id='graph5'),
+                dcc.Graph(style={'width': '50%', 'height': '50%'}, id='graph6')
             ], style={'display': 'flex',
                       'flex-direction': 'row',
                       'width': '100%',
-                      })
+                      }),
+
+            html.H2('Frota', style={'width': '100%', 'justify-content': 'center', 'text-align': 'center',
+                                    'border': 'solid 2px black'}),
+            dash_table.DataTable(
+                id='frota-tabela',
+                columns=[
+                    {'name': 'Dispositivo', 'id': 'dispositivo'},
+                    {'name': 'Nome', 'id': 'nome'},
+                    {'name': 'Estado', 'id': 'estado'},
+                    {'name': 'Interfaces', 'id': 'interfaces', 'type': 'numeric'},
+                    {'name': 'Taxa (MB/s)', 'id': 'taxa', 'type': 'numeric'},
+                    {'name': 'Utilização (%)', 'id': 'utilizacao', 'type': 'numeric'},
+                    {'name': 'Pacotes com erro (%)', 'id': 'erros', 'type': 'numeric'},
+                    {'name': 'Interfaces mais utilizadas', 'id': 'maisUtilizadas'},
+                    {'name': 'Interfaces com mais erros', 'id': 'maisErros'},
+                ],
+                page_current=0,
+                page_size=linhasFrota,
+                page_action='custom',
+                sort_action='custom',
+                sort_mode='multi',
+                sort_by=[]
+            )
 
         ], style={'display': 'flex', 'flex-direction': 'column'}),
 
@@ -239,64 +2761,116 @@ final_html = html.Div(
 app.layout = final_html
 
 
-def decode(string):
-    string_final = ''
-    for c in string:
-        string_final += chr(c)
-    return string_final
-
-
-x1 = deque(maxlen=20)
-y1 = deque(maxlen=20)
-x2 = deque(maxlen=20)
-y2 = deque(maxlen=20)
-x3 = deque(maxlen=20)
-y3 = deque(maxlen=20)
-x4 = deque(maxlen=20)
-y4 = deque(maxlen=20)
-x5 = deque(maxlen=20)
-y5 = deque(maxlen=20)
-x6 = deque(maxlen=20)
-y6 = deque(maxlen=20)
-
-# Informações do sistema recuperadas com apenas 1 snmpwalk
-sysInformations = snmpwalk(oids['sysInformations'])
-sysDescr = sysInformations[0]
-sysObjectID = sysInformations[1]
-sysUpTime = sysInformations[2]
-sysContact = sysInformations[3]
-sysName = sysInformations[4]
-sysLocation = sysInformations[5]
-sysServices = sysInformations[6]
-
-nonExistentDevice = False
-
-
-# Callback para tratar o botão de confirmação
+# Gráficos de desempenho: (id do gráfico, métrica, título, eixo y, fator de escala)
+graficos = [
+    ('graph1', 'icmpInEchoReps', 'Requisições ICMP ECHO Recebidas', 'Requisições', 1),
+    ('graph2', 'porcentagemPacotesErro', 'Porcentagem de pacotes recebidos com erro', '%', 1),
+    ('graph3', 'taxaBytes', 'Taxa de Bytes/Segundo', 'MegaBytes', 1 / 1000000),
+    ('graph4', 'utilizacaoLink', 'Porcentagem de utilização da largura de banda da rede', '%', 100),
+    ('graph5', 'porcentagemDatagramasErro', 'Porcentagem de datagramas IP recebidos com erro', '%', 1),
+    ('graph6', 'taxaForwarding', 'Taxa de forwarding de datagramas IP por Segundo', 'Taxa de forwarding', 1),
+]
+
+
+def serie_grafico(nome, metrica, desde=0, fator=1):
+    # Pontos do buffer em memória posteriores a 'desde' e o timestamp do último deles
+    serie = coletor.serie(nome, metrica, pontosGrafico)
+    if serie is None or len(serie[0]) == 0:
+        return [], [], desde
+
+    timestamps, valores = serie
+    inicio = bisect.bisect_right(timestamps, desde)
+    x = [datetime.fromtimestamp(timestamp) for timestamp in timestamps[inicio:]]
+    y = [valor * fator for valor in valores[inicio:]]
+    return x, y, float(timestamps[-1])
+
+
+def figura(titulo, eixo_y, x, y):
+    # Os eixos ficam em autorange, recalculado pelo navegador a cada extendData
+    data = plotly.graph_objs.Scatter(
+        x=x,
+        y=y,
+        name='Scatter',
+        mode='lines+markers'
+    )
+
+    layout = go.Layout(
+        title=titulo,
+        xaxis=dict(title='Tempo (hh:mm:ss)'),
+        yaxis=dict(title=eixo_y),
+    )
+
+    return {'data': [data], 'layout': layout}
+
+
+def figura_historico(nome, metrica, titulo, eixo_y, periodo, fator=1):
+    # Gráfico do período escolhido montado a partir do histórico gravado em disco
+    fim = time.time()
+    intervalo = int(devices[nome].get('interval_time') or intervalTime)
+    timestamps, valores = armazenamento.consultar(nome, metrica, fim - periodo, fim, intervalo=intervalo)
+
+    data = plotly.graph_objs.Scatter(
+        x=[datetime.fromtimestamp(timestamp) for timestamp in timestamps],
+        y=[valor * fator for valor in valores],
+        name='Scatter',
+        mode='lines'
+    )
+
+    layout = go.Layout(
+        title=titulo,
+        xaxis=dict(title='Tempo', range=[datetime.fromtimestamp(fim - periodo), datetime.fromtimestamp(fim)]),
+        yaxis=dict(title=eixo_y),
+    )
+
+    return {'data': [data], 'layout': layout}
+
+
 @app.callback(
     Output('confirmation-message', 'children'),
     Input('confirm-button', 'n_clicks'),
     State('device-name', 'value'),
     State('device-location', 'value'),
-    State('device-interfaces', 'value')
+    State('device-interfaces', 'value'),
+    State('device-version', 'value'),
+    State('device-user', 'value'),
+    State('device-auth-protocol', 'value'),
+    State('device-auth-key', 'value'),
+    State('device-priv-protocol', 'value'),
+    State('device-priv-key', 'value')
 )
-def add_device(n_clicks, ip, community_param, interval_time_param):
+def add_device(n_clicks, ip, community_param, interval_time_param, version, user, auth_protocol, auth_key,
+               priv_protocol, priv_key):
     if n_clicks > 0:
         if ip:
-            devices[ip] = {'ip': ip, 'community': community_param, 'interval_time': interval_time_param}
+            device = {'ip': ip, 'interval_time': interval_time_param, 'version': version}
+            if version == 'v3':
+                if not user:
+                    return 'Informe o usuário SNMPv3'
+                # Nível de segurança pelo que foi preenchido: noAuthNoPriv, authNoPriv ou authPriv
+                device['user'] = user
+                device['auth_protocol'] = auth_protocol if auth_key else 'none'
+                device['auth_key'] = auth_key or None
+                device['priv_protocol'] = priv_protocol if auth_key and priv_key else 'none'
+                device['priv_key'] = (auth_key and priv_key) or None
+            else:
+                # Comunidade em branco vira 'public', como no cadastro em lote
+                device['community'] = community_param or 'public'
+            devices[ip] = device
+            # O cadastro fica no banco para o coletor em outro processo e para as próximas execuções
+            armazenamento.registrar_dispositivo(ip, devices[ip])
 
 
 @app.callback(
-    Output('selected-device-info', 'children'),
+    [Output('selected-device-info', 'children'), Output('my-input', 'interval'),
+     Output('dispositivo-selecionado', 'data')],
     Input('device-dropdown', 'value')
 )
 def update_selected_device(selected_device):
-    global selectedDevice, agentStatus
-    if selected_device in devices:
-        selectedDevice = devices[selected_device]
-        agentStatus['color'] = 'red'
-        agentStatus['background'] = 'black'
-        agentStatus['index'] = 1
+    if selected_device not in devices:
+        return None, dash.no_update, dash.no_update
+
+    # A interface atualiza no mesmo ritmo em que o dispositivo selecionado é coletado
+    return None, int(devices[selected_device].get('interval_time') or intervalTime) * 1000, selected_device
 
 
 @app.callback(
@@ -310,274 +2884,296 @@ def update_dropdown_options(n_clicks):
 
 
 # Os gráficos abaixo são para Desempenho
+# As figuras completas só são montadas quando o dispositivo ou o período mudam; no tempo real cada intervalo
+# envia ao navegador apenas os pontos novos, por extendData, mantendo no máximo pontosGrafico pontos por gráfico
 @app.callback(
-    Output('graph1', 'figure'),
-    [Input('my-input', 'n_intervals')]
+    [Output(grafico[0], 'figure') for grafico in graficos] + [Output('graficos-ultimo', 'data')],
+    [Input('dispositivo-selecionado', 'data'), Input('periodo-dropdown', 'value')]
 )
-def update_graph1(n):
-    tempo_atual_em_segundos = time.time()
-    data_hora_atual = datetime.fromtimestamp(tempo_atual_em_segundos)
-    x1.append(data_hora_atual)
-    y1.append(int(snmpget(oids['icmpInEchoReps'])))
-
-    data = plotly.graph_objs.Scatter(
-        x=list(x1),
-        y=list(y1),
-        name='Scatter',
-        mode='lines+markers'
-    )
+def update_graphs(selected_device, periodo):
+    if selected_device not in devices:
+        raise PreventUpdate
+
+    figuras = []
+    ultimos = {}
+    for _, metrica, titulo, eixo_y, fator in graficos:
+        if periodo:
+            figuras.append(figura_historico(selected_device, metrica, titulo, eixo_y, periodo, fator))
+        else:
+            x, y, ultimos[metrica] = serie_grafico(selected_device, metrica, fator=fator)
+            figuras.append(figura(titulo, eixo_y, x, y))
 
-    layout = go.Layout(
-        title='Requisições ICMP ECHO Recebidas',
-        xaxis=dict(title='Tempo (hh:mm:ss)', range=[min(x1), max(x1)]),
-        yaxis=dict(title='Requisições', range=[min(y1), max(y1)]),
-    )
-
-    return {'data': [data], 'layout': layout}
+    return figuras + [ultimos]
 
 
 @app.callback(
-    Output('graph2', 'figure'),
-    [Input('my-input', 'n_intervals')]
+    [Output(grafico[0], 'extendData') for grafico in graficos] +
+    [Output('graficos-ultimo', 'data', allow_duplicate=True)],
+    Input('my-input', 'n_intervals'),
+    [State('graficos-ultimo', 'data'), State('dispositivo-selecionado', 'data'), State('periodo-dropdown', 'value')],
+    prevent_initial_call=True
 )
-def update_graph2(n):
-    tempo_atual_em_segundos = time.time()
-    data_hora_atual = datetime.fromtimestamp(tempo_atual_em_segundos)
-    x2.append(data_hora_atual)
-    y2.append(porcentagem_pacotes_recebidos_erro())
+def extend_graphs(n, ultimos, selected_device, periodo):
+    if periodo or ultimos is None or selected_device not in devices:
+        raise PreventUpdate
 
-    data = plotly.graph_objs.Scatter(
-        x=list(x2),
-        y=list(y2),
-        name='Scatter',
-        mode='lines+markers'
-    )
-
-    layout = go.Layout(
-        title='Porcentagem de pacotes recebidos com erro',
-        xaxis=dict(title='Tempo (hh:mm:ss)', range=[min(x2), max(x2)]),
-        yaxis=dict(title='%', range=[min(y2), max(y2)]),
-    )
+    ultimos = dict(ultimos)
+    extensoes = []
+    for _, metrica, _, _, fator in graficos:
+        x, y, ultimos[metrica] = serie_grafico(selected_device, metrica, ultimos.get(metrica, 0), fator)
+        extensoes.append((dict(x=[x], y=[y]), [0], pontosGrafico) if x else dash.no_update)
 
-    return {'data': [data], 'layout': layout}
+    if all(extensao is dash.no_update for extensao in extensoes):
+        raise PreventUpdate
 
+    return extensoes + [ultimos]
 
-@app.callback(
-    Output('graph3', 'figure'),
-    [Input('my-input', 'n_intervals')]
-)
-def update_graph3(n):
-    tempo_atual_em_segundos = time.time()
-    data_hora_atual = datetime.fromtimestamp(tempo_atual_em_segundos)
-    x3.append(data_hora_atual)
-    y3.append(int(taxa_bytes_segundo() / 1000000))
 
-    data = plotly.graph_objs.Scatter(
-        x=list(x3),
-        y=list(y3),
-        name='Scatter',
-        mode='lines+markers'
-    )
+# Painéis estáticos já montados, por (dispositivo, versão do inventário); a versão é um hash do conteúdo
+paineisEstaticos = OrderedDict()
+limitePaineis = 256
 
-    layout = go.Layout(
-        title='Taxa de Bytes/Segundo',
-        xaxis=dict(title='Tempo (hh:mm:ss)', range=[min(x3), max(x3)]),
-        yaxis=dict(title='MegaBytes', range=[min(y3), max(y3)]),
-    )
 
-    return {'data': [data], 'layout': layout}
+def painel_estatico(nome, amostra):
+    # O conteúdo só muda quando o inventário do dispositivo é relido, então o painel é montado uma vez por versão
+    chave = (nome, amostra['versaoInventario'])
+    if chave in paineisEstaticos:
+        paineisEstaticos.move_to_end(chave)
+        return paineisEstaticos[chave]
 
+    # Objetos que o agente não implementa (None) ficam fora do painel
+    campos = [('Nome do dispositivo: ', amostra['sysName']),
+              ('Localização: ', amostra['sysLocation'] if amostra['sysLocation'] != '' else 'Unknown'),
+              ('Número de interfaces presentes no sistema: ', amostra['ifNumber'])]
 
-@app.callback(
-    Output('graph4', 'figure'),
-    [Input('my-input', 'n_intervals')]
-)
-def update_graph4(n):
-    tempo_atual_em_segundos = time.time()
-    data_hora_atual = datetime.fromtimestamp(tempo_atual_em_segundos)
-    x4.append(data_hora_atual)
-    y4.append(int(utilizacao_link() * 100))
+    if amostra['sysDescr'] is not None:
+        hardware, _, software = amostra['sysDescr'].partition("Software: ")
+        campos += [('Hardware: ', hardware[10:len(hardware) - 2]), ('Software: ', software)]
 
-    data = plotly.graph_objs.Scatter(
-        x=list(x4),
-        y=list(y4),
-        name='Scatter',
-        mode='lines+markers'
-    )
+    campos += [('Total de serviços que o sistema suporta: ', amostra['sysServices']),
+               ('Informações de contato do administrador do sistema: ',
+                amostra['sysContact'] if amostra['sysContact'] != '' else 'None'),
+               ('Identificador de objeto do sistema: ', amostra['sysObjectID'])]
 
-    layout = go.Layout(
-        title='Porcentagem de utilização da largura de banda da rede',
-        xaxis=dict(title='Tempo (hh:mm:ss)', range=[min(x4), max(x4)]),
-        yaxis=dict(title='%', range=[min(y4), max(y4)]),
-    )
+    title_table = html.Table([html.Tr(html.Th('Interfaces de Rede:'))], style={'width': '100%'})
 
-    return {'data': [data], 'layout': layout}
+    content_trs = [html.Tr(html.Td(f'{nome_interface}, ', style={'width': '33%'}))
+                   for nome_interface in amostra['ifName'] if nome_interface is not None]
+    content_table = html.Table(content_trs, style={'display': 'flex', 'flex-wrap': 'wrap', 'width': '100%'})
 
+    table_html = html.Div([title_table, content_table])
 
-@app.callback(
-    Output('graph5', 'figure'),
-    [Input('my-input', 'n_intervals')]
-)
-def update_graph5(n):
-    tempo_atual_em_segundos = time.time()
-    data_hora_atual = datetime.fromtimestamp(tempo_atual_em_segundos)
-    x5.append(data_hora_atual)
-    y5.append(int(porcentagem_datagramas_ip_recebidos_erro()))
+    linhas = []
+    for rotulo, valor in campos:
+        if valor is not None:
+            linhas += [html.Label([rotulo], style={'font-weight': 'bold'}), html.Label(f"{valor}"), html.Br()]
 
-    data = plotly.graph_objs.Scatter(
-        x=list(x5),
-        y=list(y5),
-        name='Scatter',
-        mode='lines+markers'
-    )
+    painel = html.Div(linhas + [table_html],
+                      style={'display': 'flex', 'flex-direction': 'column', 'height': '80%',
+                             'justify-content': 'center', 'text-align': 'center'})
 
-    layout = go.Layout(
-        title='Porcentagem de datagramas IP recebidos com erro',
-        xaxis=dict(title='Tempo (hh:mm:ss)', range=[min(x5), max(x5)]),
-        yaxis=dict(title='%', range=[min(y5), max(y5)]),
-    )
+    paineisEstaticos[chave] = painel
+    if len(paineisEstaticos) > limitePaineis:
+        paineisEstaticos.popitem(last=False)
 
-    return {'data': [data], 'layout': layout}
+    return painel
 
 
 @app.callback(
-    Output('graph6', 'figure'),
-    [Input('my-input', 'n_intervals')]
+    [Output(component_id='my-output', component_property='children'),
+     Output(component_id='painel-versao', component_property='data')],
+    [Input(component_id='my-input', component_property='n_intervals'),
+     Input(component_id='dispositivo-selecionado', component_property='data')],
+    State(component_id='painel-versao', component_property='data')
 )
-def update_graph6(n):
-    tempo_atual_em_segundos = time.time()
-    data_hora_atual = datetime.fromtimestamp(tempo_atual_em_segundos)
-    x6.append(data_hora_atual)
-    y6.append(int(porcentagem_datagramas_ip_recebidos_erro()))
+def update_data(n, selected_device, versao_exibida):
+    # Só envia o painel estático quando a aba mostra outro dispositivo ou uma versão antiga do inventário
+    amostra = amostra_atual(selected_device)
+    versao = [selected_device, amostra['versaoInventario']]
+    if versao == versao_exibida:
+        raise PreventUpdate
 
-    data = plotly.graph_objs.Scatter(
-        x=list(x6),
-        y=list(y6),
-        name='Scatter',
-        mode='lines+markers'
-    )
-
-    layout = go.Layout(
-        title='Taxa de forwarding de datagramas IP por Segundo',
-        xaxis=dict(title='Tempo (hh:mm:ss)', range=[min(x6), max(x6)]),
-        yaxis=dict(title='Taxa de forwarding', range=[min(y6), max(y6)]),
-    )
-
-    return {'data': [data], 'layout': layout}
+    return painel_estatico(selected_device, amostra), versao
 
 
 @app.callback(
-    Output(component_id='my-output', component_property='children'),
-    Input(component_id='my-input', component_property='n_intervals')
+    Output(component_id='my-output-status', component_property='children'),
+    [Input(component_id='my-input', component_property='n_intervals'),
+     Input(component_id='dispositivo-selecionado', component_property='data')]
 )
-def update_data(n):
-    global selectedDevice, host, community, intervalTime, agentStatus, sysInformations, sysDescr, \
-        sysObjectID, sysUpTime, sysContact, sysName, sysLocation, sysServices
-
-    host = selectedDevice['ip']
-    community = selectedDevice['community']
-    intervalTime = selectedDevice['interval_time']
-
-    sysInformations = snmpwalk(oids['sysInformations'])
-    sysDescr = sysInformations[0]
-    sysObjectID = sysInformations[1]
-    sysUpTime = sysInformations[2]
-    sysContact = sysInformations[3]
-    sysName = sysInformations[4]
-    sysLocation = sysInformations[5]
-    sysServices = sysInformations[6]
-
-    # Verifica sysUpTime do agente, se for menor que 1 minuto, significa que caiu, mostrar mensagem
-    if sysUpTime < 60:
-        agentStatus['color'] = 'red'
-        agentStatus['background'] = 'black'
-        agentStatus['index'] = 1
+def update_status(n, selected_device):
+    if selected_device not in devices:
+        raise PreventUpdate
+
+    # Não depende de uma amostra nova: com o agente inativo o aviso aparece sem esperar nenhuma requisição
+    coletor.marcar_visualizado(selected_device)
+    estado = coletor.estado(selected_device)
+    amostra = coletor.ultima_amostra(selected_device)
+    if amostra is None and estado is None:
+        raise PreventUpdate
+
+    inativo = estado is not None and not estado['ativo']
+    if inativo:
+        aviso = f"Agente inativo desde {datetime.fromtimestamp(estado['desde']):%H:%M:%S}! Tentando reconexão..."
     else:
-        agentStatus['color'] = 'transparent'
-        agentStatus['background'] = 'transparent'
-        agentStatus['index'] = -1
-
-    sys_descr_object = decode(sysDescr)
-    software = sys_descr_object.split("Software: ")
-    hardware = sys_descr_object.split("Software: ")
-    hardware = hardware[0]
+        aviso = 'Agente inativo! Tentando reconexão...'
 
-    total_milissegundos = sysUpTime
-    total_segundos = total_milissegundos // 100
-    dias = total_segundos // (24 * 3600)
-    horas = (total_segundos % (24 * 3600)) // 3600
-    minutos = (total_segundos % 3600) // 60
-    segundos = total_segundos % 60
+    # Agente inativo ou reiniciado há menos de 1 minuto (regra agenteReiniciado do motor de alertas)
+    if inativo or coletor.alerta_ativo(selected_device, 'agenteReiniciado'):
+        cor, fundo, camada = 'red', 'black', 1
+    else:
+        cor, fundo, camada = 'transparent', 'transparent', -1
 
-    nome = sysName
+    conteudo = [
+        html.H1(aviso,
+                style={'color': cor, 'width': '100%', 'justify-content': 'center',
+                       'text-align': 'center', 'position': 'absolute', 'top': '2%',
+                       'background': fundo, 'z-index': str(camada)})
+    ]
+
+    if amostra is not None:
+        total_milissegundos = amostra['sysUpTime']
+        total_segundos = total_milissegundos // 100
+        dias = total_segundos // (24 * 3600)
+        horas = (total_segundos % (24 * 3600)) // 3600
+        minutos = (total_segundos % 3600) // 60
+        segundos = total_segundos % 60
+
+        conteudo += [
+            html.Label(["Tempo Ativo do Sistema: "], style={'font-weight': 'bold'}),
+            html.Label(f"{dias} dias, {horas} horas, {minutos} minutos e {segundos} segundos")
+        ]
 
-    local = 'Unknown' if decode(sysLocation) == '' else decode(sysLocation)
+    return html.Div(conteudo, style={'display': 'flex', 'flex-direction': 'column', 'justify-content': 'center',
+                                     'text-align': 'center'})
+
+
+# ******************************* Visão da frota *******************************
+# Linhas da tabela calculadas a partir das amostras já coletadas; cada linha é recalculada apenas quando chega
+# uma amostra nova do dispositivo
+cacheFrota = {}
+
+
+def linha_frota(nome, amostra):
+    em_cache = cacheFrota.get(nome)
+    if em_cache is not None and em_cache[0] is amostra:
+        return em_cache[1]
+
+    dispositivo = {}
+    utilizacoes = []
+    erros = []
+    nomes_interfaces = dict(zip(amostra['ifIndex'], amostra['ifName']))
+    for metrica, interface, valor in amostra['metricas']:
+        if interface == 0:
+            dispositivo[metrica] = valor
+        elif metrica == 'ifUtilizacao':
+            utilizacoes.append((valor, interface))
+        elif metrica == 'ifInErrors':
+            erros.append((valor, interface))
+
+    def destaques(valores, unidade, fator=1):
+        return ', '.join(f"{nomes_interfaces.get(interface) or interface} "
+                         f"({valor * fator:.1f}{unidade})"
+                         for valor, interface in heapq.nlargest(interfacesFrota, valores) if valor > 0)
+
+    linha = {
+        'dispositivo': nome,
+        'nome': amostra['sysName'],
+        'interfaces': amostra['ifNumber'],
+        'taxa': None if 'taxaBytes' not in dispositivo else round(dispositivo['taxaBytes'] / 1000000, 3),
+        'utilizacao': None if 'utilizacaoLink' not in dispositivo else round(dispositivo['utilizacaoLink'] * 100, 2),
+        'erros': None if 'porcentagemPacotesErro' not in dispositivo
+        else round(dispositivo['porcentagemPacotesErro'] * 100, 2),
+        'maisUtilizadas': destaques(utilizacoes, '%', 100),
+        'maisErros': destaques(erros, '/s'),
+    }
+    cacheFrota[nome] = (amostra, linha)
+    return linha
+
+
+def estado_dispositivo(device, amostra, estado, agora):
+    if estado is not None and not estado['ativo']:
+        return 'inativo'
+    if amostra is None:
+        return 'sem dados'
+    # Sem amostra nova em três intervalos o agente é considerado inativo
+    if agora - amostra['timestamp'] > 3 * int(device.get('interval_time') or intervalTime):
+        return 'inativo'
+    # sysUpTime em centésimos de segundo: menos de 1 minuto indica que o agente acabou de reiniciar
+    if amostra['sysUpTime'] < 6000:
+        return 'reiniciado'
+    return 'ativo'
+
+
+def visao_frota():
+    agora = time.time()
+    amostras, estados = coletor.frota()
+    linhas = []
+    for nome, device in list(devices.items()):
+        amostra = amostras.get(nome)
+        linha = {'dispositivo': nome} if amostra is None else dict(linha_frota(nome, amostra))
+        linha['estado'] = estado_dispositivo(device, amostra, estados.get(nome), agora)
+        linhas.append(linha)
+
+    for nome in set(cacheFrota) - set(devices):
+        cacheFrota.pop(nome, None)
+
+    return linhas
+
+
+def ordenar_frota(linhas, sort_by):
+    # Ordenação estável por várias colunas; valores ausentes ficam sempre no fim
+    for criterio in reversed(sort_by or []):
+        coluna = criterio['column_id']
+        com_valor = [linha for linha in linhas if linha.get(coluna) not in (None, '')]
+        sem_valor = [linha for linha in linhas if linha.get(coluna) in (None, '')]
+        com_valor.sort(key=lambda linha: linha[coluna], reverse=criterio['direction'] == 'desc')
+        linhas = com_valor + sem_valor
+    return linhas
 
-    n_interfaces = snmpget(oids['ifNumber'])
 
-    servicos = sysServices
+@app.callback(
+    [Output('frota-tabela', 'data'), Output('frota-tabela', 'page_count')],
+    [Input('my-input', 'n_intervals'), Input('frota-tabela', 'page_current'), Input('frota-tabela', 'page_size'),
+     Input('frota-tabela', 'sort_by')]
+)
+def update_fleet(n, page_current, page_size, sort_by):
+    linhas = ordenar_frota(visao_frota(), sort_by)
+    inicio = page_current * page_size
+    return linhas[inicio:inicio + page_size], max(1, -(-len(linhas) // page_size))
 
-    admin_contato = 'None' if decode(sysContact) == '' else decode(sysContact)
 
-    id_sistema = sysObjectID
+# ******************************* Instrumentação da interface *******************************
+@app.server.before_request
+def iniciar_callback():
+    g.inicio_callback = time.time()
 
-    table = snmpbulkget(oids['ifName'], False)
 
-    title_table = html.Table([html.Tr(html.Th('Interfaces de Rede:'))], style={'width': '100%'})
+@app.server.after_request
+def medir_callback(resposta):
+    # Tempo de cada callback do Dash, identificado pelas saídas que ele atualiza
+    if request.path.endswith('/_dash-update-component') and 'inicio_callback' in g:
+        corpo = request.get_json(silent=True) or {}
+        metricas.observar('callback_segundos', time.time() - g.inicio_callback, callback=corpo.get('output', '?'))
+    return resposta
 
-    content_trs = [html.Tr(html.Td(f'{decode(table[i])}, ', style={'width': '33%'})) for i in range(n_interfaces - 1)]
-    content_table = html.Table(content_trs, style={'display': 'flex', 'flex-wrap': 'wrap', 'width': '100%'})
-
-    table_html = html.Div([title_table, content_table])
 
-    # Informações
-    dump = html.Div([
-        html.H1('Agente inativo! Tentando reconexão...',
-                style={'color': f"{agentStatus['color']}", 'width': '100%', 'justify-content': 'center',
-                       'text-align': 'center', 'position': 'absolute', 'top': '2%',
-                       'background': f"{agentStatus['background']}",
-                       'z-index': f"{agentStatus['index']}"}),
-        html.Label(["Nome do dispositivo: "], style={'font-weight': 'bold'}),
-        html.Label(f"{decode(nome)}"),
-        html.Br(),
-        html.Label(["Localização: "], style={'font-weight': 'bold'}), html.Label(f"{local}"),
-        html.Br(),
-        html.Label(["Número de interfaces presentes no sistema: "], style={'font-weight': 'bold'}),
-        html.Label(f"{n_interfaces}"),
-        html.Br(),
-        html.Label(["Hardware: "], style={'font-weight': 'bold'}), html.Label(f"{hardware[10:len(hardware) - 2]}"),
-        html.Br(),
-        html.Label(["Software: "], style={'font-weight': 'bold'}), html.Label(f"{software[1]}"),
-        html.Br(),
-        html.Label(["Tempo Ativo do Sistema: "], style={'font-weight': 'bold'}),
-        html.Label(f"{dias} dias, {horas} horas, {minutos} minutos e {segundos} segundos"),
-        html.Br(),
-        html.Label(["Total de serviços que o sistema suporta: "], style={'font-weight': 'bold'}),
-        html.Label(f"{servicos}"),
-        html.Br(),
-        html.Label(["Informações de contato do administrador do sistema: "], style={'font-weight': 'bold'}),
-        html.Label(f"{admin_contato}"),
-        html.Br(),
-        html.Label(["Identificador de objeto do sistema: "], style={'font-weight': 'bold'}),
-        html.Label(f"{id_sistema}"),
-        html.Br(),
-        table_html
-    ], style={'display': 'flex', 'flex-direction': 'column', 'height': '80%', 'justify-content': 'center',
-              'text-align': 'center'})
-
-    return dump
+@app.server.route('/metrics')
+def exportar_metricas():
+    # Instrumentação do gerente no formato texto do Prometheus, incluindo a dos processos de coleta
+    texto = metricas.texto(getattr(coletor, 'metricas_processos', None))
+    return Response(texto, mimetype='text/plain; version=0.0.4')
 
 
 # ******************************* Métricas *******************************
-if_number_object = int(snmpget(oids['ifNumber']))
-second_time = time.time()
-first_time = int(time.time() - intervalTime)
+# As métricas são calculadas a partir de uma amostra do coletor, sem novas requisições.
+# As taxas vêm do MotorTaxas e valem None até existirem duas amostras do dispositivo.
 
 
-def porcentagem_pacotes_recebidos_erro():
-    if_in_errors = sum(snmpbulkget(oids['ifInErrors']))
-    if_in_ucast_pkts = sum(snmpbulkget(oids['ifInUcastPkts']))
-    if_in_n_ucast_pkts = sum(snmpbulkget(oids['ifInNUcastPkts']))
+def porcentagem_pacotes_recebidos_erro(amostra):
+    if_in_errors = sum(valor for valor in amostra['ifInErrors'] if valor is not None)
+    if_in_ucast_pkts = sum(valor for valor in amostra['ifInUcastPkts'] if valor is not None)
+    if_in_n_ucast_pkts = sum(valor for valor in amostra['ifInNUcastPkts'] if valor is not None)
 
     if (if_in_ucast_pkts + if_in_n_ucast_pkts) > 0:
         return if_in_errors / (if_in_ucast_pkts + if_in_n_ucast_pkts)
@@ -585,34 +3181,157 @@ def porcentagem_pacotes_recebidos_erro():
     return if_in_errors
 
 
-def taxa_bytes_segundo():
-    if_in_octets = sum(snmpbulkget(oids['ifInOctets']))
-    if_out_octets = sum(snmpbulkget(oids['ifOutOctets']))
+def taxas_octetos(amostra, sentido):
+    # Bytes/s de cada interface no sentido 'In' ou 'Out', usando o contador de 64 bits onde ele é suportado
+    taxas_64 = amostra['taxas'].get(f'ifHC{sentido}Octets')
+    taxas_32 = amostra['taxas'].get(f'if{sentido}Octets')
+
+    # Nenhum contador de octetos lido (agente sem interfaces): taxas indefinidas para cada interface
+    if taxas_64 is None and taxas_32 is None:
+        return [float('nan')] * len(amostra['ifIndex'])
+    if taxas_64 is None:
+        return taxas_32
+    if taxas_32 is None:
+        return taxas_64
+
+    if np is not None:
+        return np.where(np.asarray(amostra['suporteHC'], dtype=bool), taxas_64, taxas_32)
+    return [taxa_64 if suporte else taxa_32
+            for taxa_64, taxa_32, suporte in zip(taxas_64, taxas_32, amostra['suporteHC'])]
+
+
+def velocidades_interfaces(amostra):
+    # Velocidade em bits/s de cada interface. O ifSpeed satura em 4.294.967.295; acima de 4 Gbps vale o
+    # ifHighSpeed, que é dado em Mbps
+    velocidades = []
+    for if_speed, if_high_speed in zip(amostra['ifSpeed'], amostra['ifHighSpeed']):
+        if if_high_speed and (if_speed >= 4294967295 or if_high_speed > 4000):
+            velocidades.append(if_high_speed * 1000000)
+        else:
+            velocidades.append(if_speed)
+    return velocidades
+
+
+def taxa_bytes_segundo(amostra):
+    if_in_octets = soma_taxas(taxas_octetos(amostra, 'In'))
+    if_out_octets = soma_taxas(taxas_octetos(amostra, 'Out'))
+
+    if if_in_octets is None or if_out_octets is None:
+        return None
 
-    return ((((if_in_octets + if_out_octets) * second_time) - ((if_in_octets + if_out_octets) * first_time)) /
-            (second_time - first_time))
+    return if_in_octets + if_out_octets
 
 
-def utilizacao_link():
-    if_speed = sum(snmpbulkget(oids['ifSpeed']))
+def utilizacao_link(amostra):
+    if_speed = sum(velocidades_interfaces(amostra))
+    taxa = taxa_bytes_segundo(amostra)
 
-    return (taxa_bytes_segundo() * 8) / if_speed
+    if taxa is None or if_speed == 0:
+        return None
 
+    return (taxa * 8) / if_speed
 
-def porcentagem_datagramas_ip_recebidos_erro():
-    ip_in_hdr_errors = snmpget(oids['ipInHdrErrors'])
-    ip_in_addr_errors = snmpget(oids['ipInAddrErrors'])
-    ip_in_unknown_protos = snmpget(oids['ipInUnknownProtos'])
-    ip_in_receives = snmpget(oids['ipInReceives'])
+
+def porcentagem_datagramas_ip_recebidos_erro(amostra):
+    ip_in_hdr_errors = amostra['ipInHdrErrors']
+    ip_in_addr_errors = amostra['ipInAddrErrors']
+    ip_in_unknown_protos = amostra['ipInUnknownProtos']
+    ip_in_receives = amostra['ipInReceives']
+
+    if None in (ip_in_hdr_errors, ip_in_addr_errors, ip_in_unknown_protos) or not ip_in_receives:
+        return None
 
     return ((ip_in_hdr_errors + ip_in_addr_errors + ip_in_unknown_protos) / ip_in_receives) * 100
 
 
-def taxa_forwarding_segundo():
-    ip_forw_datagrams = snmpget(oids['ipForwDatagrams'])
+def taxa_forwarding_segundo(amostra):
+    taxas = amostra['taxas'].get('ipForwDatagrams')
+    return None if taxas is None else soma_taxas(taxas)
 
-    return ((ip_forw_datagrams * second_time) - (ip_forw_datagrams * first_time)) / (second_time - first_time)
+
+def metricas_amostra(amostra):
+    # Pontos (metrica, interface, valor) gravados no histórico; interface 0 guarda as métricas do dispositivo
+    pontos = [
+        ('tempoAtivo', 0, amostra['sysUpTime'] / 100),
+        ('icmpInEchoReps', 0, amostra['icmpInEchoReps']),
+        ('porcentagemPacotesErro', 0, porcentagem_pacotes_recebidos_erro(amostra)),
+        ('taxaBytes', 0, taxa_bytes_segundo(amostra)),
+        ('utilizacaoLink', 0, utilizacao_link(amostra)),
+        ('taxaForwarding', 0, taxa_forwarding_segundo(amostra)),
+        ('porcentagemDatagramasErro', 0, porcentagem_datagramas_ip_recebidos_erro(amostra)),
+    ]
+
+    if amostra['taxas'].get('ifInErrors') is not None:
+        taxas_interfaces = {
+            'ifInOctets': taxas_octetos(amostra, 'In'),
+            'ifOutOctets': taxas_octetos(amostra, 'Out'),
+            'ifInErrors': amostra['taxas']['ifInErrors'],
+        }
+        for metrica, taxas in taxas_interfaces.items():
+            pontos += [(metrica, if_index, taxa) for if_index, taxa in zip(amostra['ifIndex'], taxas)]
+
+        for if_index, taxa_in, taxa_out, velocidade in zip(amostra['ifIndex'], taxas_interfaces['ifInOctets'],
+                                                            taxas_interfaces['ifOutOctets'],
+                                                            velocidades_interfaces(amostra)):
+            if velocidade:
+                pontos.append(('ifUtilizacao', if_index, (taxa_in + taxa_out) * 8 / velocidade))
+
+    # Taxas indefinidas (NaN, primeira amostra ou contador reiniciado) não são gravadas
+    return [(metrica, interface, float(valor)) for metrica, interface, valor in pontos
+            if valor is not None and valor == valor]
 
 
 if __name__ == '__main__':
-    app.run_server(host='127.0.0.1', port=8080, debug=True)
+    parser = argparse.ArgumentParser(description='Gerente SNMP')
+    parser.add_argument('modo', nargs='?', choices=['serve', 'collect', 'view', 'import', 'discover'],
+                        default='serve',
+                        help='serve: interface com coleta embutida; collect: apenas coleta, sem interface; '
+                             'view: apenas interface, lendo o que o collect grava; import: cadastra os '
+                             'dispositivos de um CSV/YAML; discover: procura agentes em uma faixa CIDR')
+    parser.add_argument('alvo', nargs='?', help='arquivo (import) ou faixa CIDR (discover)')
+    parser.add_argument('--community', action='append', help='comunidade testada na descoberta (repetível)')
+    parser.add_argument('--version', choices=list(snmpVersions), default='v2c')
+    parser.add_argument('--user')
+    parser.add_argument('--auth-protocol', choices=list(protocolosAutenticacao), default='sha')
+    parser.add_argument('--auth-key')
+    parser.add_argument('--priv-protocol', choices=list(protocolosPrivacidade), default='aes')
+    parser.add_argument('--priv-key')
+    parser.add_argument('--port', type=int, default=port)
+    parser.add_argument('--timeout', type=float, default=1, help='timeout (s) de cada sonda na descoberta')
+    parser.add_argument('--interval', type=int, default=intervalTime, help='periodicidade dos descobertos')
+    parser.add_argument('--concorrencia', type=int, default=256)
+    parser.add_argument('--taxa', type=float, default=200, help='sondas por segundo na descoberta')
+    args = parser.parse_args()
+
+    if args.modo in ('import', 'discover') and not args.alvo:
+        parser.error(f'o modo {args.modo} precisa de um alvo')
+
+    if args.modo == 'collect':
+        executar_coletor()
+    elif args.modo == 'import':
+        importar_dispositivos(args.alvo)
+    elif args.modo == 'discover':
+        base = {'port': args.port, 'version': args.version, 'interval_time': args.interval}
+        if args.version == 'v3':
+            modelos = [normalizar_dispositivo(dict(base, ip='0.0.0.0', user=args.user,
+                                                   auth_protocol=args.auth_protocol if args.auth_key else 'none',
+                                                   auth_key=args.auth_key,
+                                                   priv_protocol=args.priv_protocol if args.priv_key else 'none',
+                                                   priv_key=args.priv_key))[1]]
+        else:
+            modelos = [dict(base, community=community) for community in args.community or ['public']]
+        descobrir(args.alvo, modelos, args.concorrencia, args.taxa, args.timeout)
+    else:
+        debug = True
+        sincronizar_dispositivos()
+        if args.modo == 'view':
+            coletor = ColetorLeitura(devices, armazenamento)
+        # Com debug o Flask recarrega o módulo em um processo filho; o coletor roda apenas nele
+        if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            if args.modo == 'serve':
+                armazenamento.iniciar()
+                receptor.iniciar()
+                # Dispositivos importados ou descobertos por outro processo entram na coleta sem reiniciar
+                threading.Thread(target=acompanhar_dispositivos, name='dispositivos', daemon=True).start()
+            coletor.iniciar()
+        app.run_server(host='127.0.0.1', port=8080, debug=debug)